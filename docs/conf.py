@@ -3,13 +3,30 @@ import sys
 import os
 import shutil
 import datetime
+from pathlib import Path
 
 now = datetime.datetime.now()
 
 #### Actualize _apidoc
-if os.path.exists('api'):
-    shutil.rmtree('api')
-os.system('sphinx-apidoc -fo api ../gdshelpers/ ../gdshelpers/test* ../gdshelpers/export/blender_import.py')
+# Only regenerate the api-files if the sources changed, rewriting them would force sphinx to re-read all files
+def _mtimes(directory, pattern):
+    return [path.stat().st_mtime for path in Path(directory).rglob(pattern)]
+
+
+def _has_removed_modules(directory):
+    # Api-files of deleted or renamed modules would otherwise stay, and autodoc would fail to import them
+    for path in Path(directory).glob('*.rst'):
+        module = Path('..', *path.stem.split('.'))
+        if path.stem != 'modules' and not (module.with_suffix('.py').exists() or (module / '__init__.py').exists()):
+            return True
+    return False
+
+
+api_mtimes = _mtimes('api', '*.rst')
+if not api_mtimes or min(api_mtimes) < max(_mtimes('../gdshelpers', '*.py')) or _has_removed_modules('api'):
+    if os.path.exists('api'):
+        shutil.rmtree('api')
+    os.system('sphinx-apidoc -fo api ../gdshelpers/ ../gdshelpers/test* ../gdshelpers/export/blender_import.py')
 
 sys.path.insert(0, os.path.abspath('../.'))
 
@@ -17,7 +34,7 @@ extensions = [
     'sphinx.ext.autodoc',
     'sphinx.ext.doctest',
     'sphinx.ext.coverage',
-    'sphinx.ext.imgmath',
+    'sphinx.ext.mathjax',
     'matplotlib.sphinxext.plot_directive',
     'sphinx.ext.graphviz',
     'm2r2'
@@ -1,4 +1,9 @@
+import io
 import os
+import subprocess
+import tempfile
+
+import numpy as np
 
 from gdshelpers.geometry import shapely_adapter
 
@@ -10,24 +15,34 @@ class Shapely3d:
     """
 
     def __init__(self, poly, extrude_val_min, extrude_val_max, rgb=(255, 255, 255)):
-        if type(poly) in (list, tuple):
-            self.poly = shapely_adapter.geometric_union(poly)
-        self.poly = shapely_adapter.shapely_collection_to_basic_objs(poly)
+        if isinstance(poly, (list, tuple)):
+            poly = shapely_adapter.geometric_union(poly)
+        self.poly = poly
         self.rgb = rgb
         self.extrude_val_min = extrude_val_min
         self.extrude_val_max = extrude_val_max
 
     def to_temp(self, scale, index):
-        b3d_lines = []
-        for obj in self.poly:
-            vertices = ["{:f} {:f}\n".format(coord[0], coord[1]) for coord in obj.exterior.coords]
-            b3d_lines.extend(["{:d};{:d};{:f};{:f};{:f};{:d};{:d};{:d}\n".format(index, len(vertices),
-                                                                                 self.extrude_val_min,
-                                                                                 self.extrude_val_max, scale,
-                                                                                 self.rgb[0], self.rgb[1],
-                                                                                 self.rgb[2])] + vertices)
-
-        return b3d_lines
+        b3d_text = io.StringIO()
+        self.write_temp(b3d_text, scale, index)
+        return b3d_text.getvalue().splitlines(keepends=True)
+
+    def write_temp(self, f_out, scale, index):
+        if self.poly.is_empty:  # e.g. the union of an empty list
+            return
+        if self.poly.geom_type == 'Polygon':
+            polygons = [self.poly]
+        elif self.poly.geom_type == 'MultiPolygon':
+            polygons = self.poly.geoms
+        else:
+            polygons = shapely_adapter.shapely_collection_to_basic_objs(self.poly)
+
+        for obj in polygons:
+            coords = np.asarray(obj.exterior.coords)[:, :2]
+            f_out.write("{:d};{:d};{:f};{:f};{:f};{:d};{:d};{:d}\n".format(index, len(coords), self.extrude_val_min,
+                                                                           self.extrude_val_max, scale, self.rgb[0],
+                                                                           self.rgb[1], self.rgb[2]))
+            np.savetxt(f_out, coords, fmt='%f')
 
 
 def save_as_blend(shapely_3d_list, filename, scale=0.1, resolution_x=1980, resolution_y=1080, resolution_percentage=100,
@@ -98,6 +113,72 @@ def render_image_and_save_as_blend(shapely_3d_list, filename, scale=0.1, resolut
                                   resolution_percentage, render_engine, camera_position_y, camera_position_x)
 
 
+def render_views_and_save_as_blend(shapely_3d_list, views, scale=0.1, resolution_x=1980, resolution_y=1080,
+                                   resolution_percentage=100, render_engine='CYCLES'):
+    """
+    writes the 'filename.png' and 'filename.blend' file for several camera positions
+
+    The geometry is only written once and all views are rendered by parallel blender processes.
+
+    :param shapely_3d_list: a list of the meshes to export
+    :param views: a list of (filename, camera_position_y, camera_position_x) tuples, one for each rendered view.
+        Like for render_image_and_save_as_blend, a '.png' extension of the filename is removed.
+    :param scale: size factor
+    :param resolution_x: set x resolution for a later render process
+    :param resolution_y: set y resolution for a later render process
+    :param resolution_percentage: set resolution percentage
+    :param render_engine: set the render engine
+    :return: nothing
+    """
+
+    with tempfile.NamedTemporaryFile('w', suffix='.tmp', delete=False) as f_out:
+        _write_data(f_out, shapely_3d_list, scale, True, True, resolution_x, resolution_y, resolution_percentage,
+                    render_engine, views[0][1], views[0][2])
+
+    processes = []
+    try:
+        for filename, camera_position_y, camera_position_x in views:
+            filename = filename[:-4] if filename.endswith('.png') else filename
+            processes.append(subprocess.Popen(_blender_command(filename, f_out.name, camera_position_y,
+                                                               camera_position_x)))
+        for process in processes:
+            process.wait()
+    except BaseException:
+        # All blender processes are stopped before the shared data file is removed
+        for process in processes:
+            process.kill()
+            process.wait()
+        raise
+    finally:
+        os.remove(f_out.name)
+
+    errors = [subprocess.CalledProcessError(process.returncode, process.args) for process in processes
+              if process.returncode]
+    if len(errors) == 1:
+        raise errors[0]
+    if errors:
+        raise subprocess.SubprocessError('{:d} blender processes failed:\n{:s}'.format(
+            len(errors), '\n'.join(str(error) for error in errors))) from errors[0]
+
+
+def _write_data(f_out, shapely_3d_list, scale, render, save_as_blend_file, resolution_x, resolution_y,
+                resolution_percentage, render_engine, camera_position_y, camera_position_x):
+    f_out.write("{:b};{:b};{:d};{:d};{:d};{:s};{:s};{:s}\n".format(render, save_as_blend_file, resolution_x,
+                                                                   resolution_y, resolution_percentage, render_engine,
+                                                                   camera_position_y, camera_position_x))
+    for index, s3d in enumerate(shapely_3d_list):
+        s3d.write_temp(f_out, scale, index)
+
+
+def _blender_command(filename, data_filename=None, camera_position_y=None, camera_position_x=None):
+    directory = os.path.dirname(os.path.abspath(__file__))
+    command = ['blender', '--background', '--python', os.path.join(directory, 'blender_import.py'), '--', filename]
+    if data_filename is not None:
+        # The data file is shared between multiple blender instances, the camera position is passed explicitly
+        command += [data_filename, camera_position_y, camera_position_x]
+    return command
+
+
 def _write_data_and_start_blender(shapely_3d_list, filename, scale, render, save_as_blend_file, resolution_x,
                                   resolution_y, resolution_percentage, render_engine, camera_position_y,
                                   camera_position_x):
@@ -116,16 +197,10 @@ def _write_data_and_start_blender(shapely_3d_list, filename, scale, render, save
     :return: nothing
     """
     with open(filename + ".tmp", "w") as f_out:
-        f_out.write("{:b};{:b};{:d};{:d};{:d};{:s};{:s};{:s}".format(render, save_as_blend_file, resolution_x,
-                                                                     resolution_y, resolution_percentage, render_engine,
-                                                                     camera_position_y, camera_position_x))
-        f_out.write('\n')
-        for index, s3d in enumerate(shapely_3d_list):
-            f_out.writelines([line for line in s3d.to_temp(scale, index)])
+        _write_data(f_out, shapely_3d_list, scale, render, save_as_blend_file, resolution_x, resolution_y,
+                    resolution_percentage, render_engine, camera_position_y, camera_position_x)
 
-    directory = os.path.dirname(os.path.abspath(__file__))
-
-    os.system("blender --background --python {:s}{:s}blender_import.py -- {:s}".format(directory, os.sep, filename))
+    subprocess.run(_blender_command(filename), check=True)
 
 
 def _example_i():
@@ -148,7 +223,6 @@ def _example_i():
 
 def _example_ii():
     from gdshelpers.parts.splitter import MMI
-    from gdshelpers.geometry import geometric_union
 
     mmi1 = MMI((0, 0), 0, 1, 42, 7.7, 2, 2)
     mmi2 = MMI((0, 10), 0, 1, 42, 7.7, 2, 2)
@@ -159,10 +233,8 @@ def _example_ii():
 
     shapely_objects = []
 
-    s3d1 = Shapely3d(geometric_union([mmi1.get_shapely_object(), mmi2.get_shapely_object(), mmi3.get_shapely_object()]),
-                     0.0, 0.7, (255, 0, 0))
-
-    s3d2 = Shapely3d(geometric_union([mmi4.get_shapely_object(), mmi5.get_shapely_object()]), 0.0, 0.7, (0, 255, 0))
+    s3d1 = Shapely3d([mmi1, mmi2, mmi3], 0.0, 0.7, (255, 0, 0))
+    s3d2 = Shapely3d([mmi4, mmi5], 0.0, 0.7, (0, 255, 0))
 
     shapely_objects.append(s3d1)
     shapely_objects.append(s3d2)
@@ -173,7 +245,6 @@ def _example_ii():
 def _example_iii():
     from gdshelpers.parts.waveguide import Waveguide
     from gdshelpers.parts.coupler import GratingCoupler
-    from gdshelpers.geometry import geometric_union
     import numpy as np
 
     coupler1 = GratingCoupler.make_traditional_coupler((250 / 2, 0), 1.3, np.deg2rad(40), 1.13, 0.85, 20,
@@ -188,20 +259,12 @@ def _example_iii():
                                                         wave_guide.current_port.origin[1]), 1.3, np.deg2rad(40), 1.13,
                                                        0.85, 20, taper_length=16, ap_max_ff=0.985, n_ap_gratings=10)
 
-    shapely_objects = [Shapely3d(geometric_union([coupler1.get_shapely_object(), wave_guide.get_shapely_object(),
-                                                  coupler2.get_shapely_object()]), 0.0, 0.7, (255, 255, 255))]
-
-    render_image_and_save_as_blend(shapely_objects, "test_device_under_right", camera_position_y='under',
-                                   camera_position_x='right')
-
-    render_image_and_save_as_blend(shapely_objects, "test_device_above_left", camera_position_y='above',
-                                   camera_position_x='left')
-
-    render_image_and_save_as_blend(shapely_objects, "test_device_under_left", camera_position_y='under',
-                                   camera_position_x='left')
+    shapely_objects = [Shapely3d([coupler1, wave_guide, coupler2], 0.0, 0.7, (255, 255, 255))]
 
-    render_image_and_save_as_blend(shapely_objects, "test_device_above_right", camera_position_y='above',
-                                   camera_position_x='right')
+    render_views_and_save_as_blend(shapely_objects, [("test_device_under_right", 'under', 'right'),
+                                                     ("test_device_above_left", 'above', 'left'),
+                                                     ("test_device_under_left", 'under', 'left'),
+                                                     ("test_device_above_right", 'above', 'right')])
 
 
 if __name__ == '__main__':
@@ -16,14 +16,18 @@ scene = bpy.context.scene
 # Load the 3d objects
 argv = sys.argv
 argv = argv[argv.index("--") + 1:]
-raw_input_from_file = open(argv[0] + ".tmp").read()
+# Optionally, a data file shared with other blender instances and the camera position can be given
+shared_data = len(argv) > 1
+raw_input_from_file = open(argv[1] if shared_data else argv[0] + ".tmp").read()
 
-for end_string in [".tmp", ".png", ".blend"]:
+for end_string in [".png", ".blend"] if shared_data else [".tmp", ".png", ".blend"]:
     if os.path.exists(argv[0] + end_string):
         os.remove(argv[0] + end_string)
 
 blocks = raw_input_from_file.split('\n')
 config = blocks[0].split(';')
+if shared_data:
+    config[6], config[7] = argv[2], argv[3]
 
 index = 1
 material_dict = {}
@@ -34,8 +38,9 @@ meshes_index = []
 
 merge_index = -1
 
-# Buffer variables needed for the calculation of the camera position
-x_min = x_max = y_min = y_max = z_min = z_max = 0
+# Buffer variables needed for the calculation of the camera position (the bounds always include the origin)
+xy_min = xy_max = np.zeros(2)
+z_min = z_max = 0
 
 # Create the meshes and link them to the scene
 while index < len(blocks) - 1:
@@ -46,23 +51,17 @@ while index < len(blocks) - 1:
     extrude_val_min = float(info[2])
     extrude_val_max = float(info[3])
     scale = float(info[4])
-    rgb = [int(info[5]), int(info[6]), int(info[7])]
+    rgb = (int(info[5]), int(info[6]), int(info[7]))
     index += 1
 
     # Read the vertices
-    vertices = [(float(blocks[i].split()[0]) * scale, float(blocks[i].split()[1]) * scale, extrude_val_min * scale)
-                for i in range(index, index + block_len)]
+    raw = np.array(' '.join(blocks[index:index + block_len]).split(), dtype=float).reshape(block_len, 2)
+    raw *= scale
+    vertices = np.column_stack([raw, np.full(block_len, extrude_val_min * scale)])
 
     # Have a look at the dimensions of the objects -> to set the camera position
-    for vertex in vertices:
-        if vertex[0] > x_max:
-            x_max = vertex[0]
-        if vertex[0] < x_min:
-            x_min = vertex[0]
-        if vertex[1] > y_max:
-            y_max = vertex[1]
-        if vertex[1] < y_min:
-            y_min = vertex[1]
+    xy_min = np.minimum(xy_min, raw.min(0))
+    xy_max = np.maximum(xy_max, raw.max(0))
 
     if extrude_val_min < z_min:
         z_min = extrude_val_min
@@ -72,20 +71,30 @@ while index < len(blocks) - 1:
     index += block_len
 
     # Create the mesh, color and extrude it
+    # The face is handed over to blender in bulk, bmesh is only used for the solidify operation
     mesh = bpy.data.meshes.new("mesh_" + str(index))
+    mesh.vertices.add(block_len)
+    mesh.vertices.foreach_set("co", vertices.astype(np.float32).ravel())
+    mesh.loops.add(block_len)
+    mesh.loops.foreach_set("vertex_index", np.arange(block_len, dtype=np.int32))
+    mesh.polygons.add(1)
+    mesh.polygons.foreach_set("loop_start", [0])
+    mesh.polygons.foreach_set("loop_total", [block_len])
+    mesh.update(calc_edges=True)  # The edges of the face are derived from its loops
     b_mesh = bmesh.new()
-    b_vertices = [b_mesh.verts.new(vertex) for vertex in vertices]
-    b_face = b_mesh.faces.new(b_vertices)
+    b_mesh.from_mesh(mesh)
+    b_mesh.faces.ensure_lookup_table()
+    b_face = b_mesh.faces[0]
     b_face.normal = (0, 0, -1)
     bmesh.ops.solidify(b_mesh, geom=[b_face], thickness=extrude_val_max * scale)
     b_mesh.to_mesh(mesh)
+    b_mesh.free()
     mesh_object = bpy.data.objects.new("obj_" + str(index), mesh)
-    material_name = str(rgb[0]).ljust(3) + str(rgb[1]).ljust(3) + str(rgb[2]).ljust(3)
-    structure_material = bpy.data.materials.new(material_name)
-    structure_material.diffuse_color = (rgb[0] / 255, rgb[1] / 255, rgb[2] / 255)
-    if material_name not in material_dict.keys():
-        material_dict.update({material_name: structure_material})
-    mesh_object.data.materials.append(material_dict[material_name])
+    if rgb not in material_dict:
+        material_name = str(rgb[0]).ljust(3) + str(rgb[1]).ljust(3) + str(rgb[2]).ljust(3)
+        material_dict[rgb] = bpy.data.materials.new(material_name)
+        material_dict[rgb].diffuse_color = (rgb[0] / 255, rgb[1] / 255, rgb[2] / 255)
+    mesh_object.data.materials.append(material_dict[rgb])
     # Add to the mesh lists
     meshes_index.append(merge_index)
     meshes.append(mesh_object)
@@ -96,42 +105,25 @@ while index < len(blocks) - 1:
 # Join the meshes corresponding to a specific Shapely3D object
 #
 
-def get_first_of_equal_index(index_list):
-    buffer_list = []
+groups = {}
+for mesh_object, merge_index in zip(meshes, meshes_index):
+    groups.setdefault(merge_index, []).append(mesh_object)
 
-    for test_index in index_list:
-        if test_index in buffer_list:
-            for j, ind in enumerate(buffer_list):
-                if ind == test_index and ind != -1:
-                    return j
-        buffer_list.append(test_index)
-    return -1
-
-
-def join_on_scene(mesh_list, index_list):
-    fuse = get_first_of_equal_index(index_list)
-    new_list = list(index_list)
-
-    if fuse != -1:
+for group in groups.values():
+    if len(group) > 1:
         bpy.ops.object.select_all(action='DESELECT')
-        mesh_list[fuse].select = True
-        bpy.context.scene.objects.active = mesh_list[fuse]
-        for k in range(fuse + 1, len(new_list)):
-            if new_list[fuse] == new_list[k]:
-                mesh_list[k].select = True
-                bpy.context.scene.objects.active = mesh_list[k]
-                new_list[k] = -1
-        new_list[fuse] = -1
+        for mesh_object in group:
+            mesh_object.select = True
+        bpy.context.scene.objects.active = group[0]
         bpy.ops.object.join()
-        join_on_scene(mesh_list, new_list)
-
-
-join_on_scene(meshes, meshes_index)
 
 #
 # Do the calculation for the camera position
 #
 
+x_min, y_min = xy_min
+x_max, y_max = xy_max
+
 # The diagonal line of the floor follows the equation y(x) = m * x + b
 if config[7] == 'right':
     m = (y_max - y_min) / (x_max - x_min) if config[6] == 'above' else - (y_max - y_min) / (x_max - x_min)
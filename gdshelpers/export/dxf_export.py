@@ -1,21 +1,28 @@
-from itertools import chain
+import io
+import math
 
 import numpy as np
 import ezdxf
 
 
-def _add_cell_to_dxf(block, cell, max_points, max_line_points):
-    for layer, polygons in cell.get_fractured_layer_dict(max_points, max_line_points).items():
+def _fracture_cell(cell, max_points, max_line_points):
+    return cell.get_fractured_layer_dict(max_points, max_line_points)
+
+
+def _add_cell_to_dxf(block, cell, fractured_layer_dict, layer_names):
+    for layer, polygons in fractured_layer_dict.items():
+        dxfattribs = {'layer': layer_names[(layer, layer)]}
         for polygon in polygons:
             if polygon.interiors:
                 raise RuntimeError('DXF only supports polygons without holes')
-            block.add_lwpolyline(chain(polygon.exterior.coords, polygon.exterior.coords[0:1]),
-                                 dxfattribs={'layer': '{:d}-{:d}'.format(layer, layer)})
+            # Shapely repeats the first point at the end, ezdxf closes the polyline itself
+            block.add_lwpolyline(np.asarray(polygon.exterior.coords)[:-1], format='xy', close=True,
+                                 dxfattribs=dxfattribs)
 
     for ref in cell.cells:
         dxfattribs = {}
         if ref['angle'] is not None:
-            dxfattribs['rotation'] = np.rad2deg(ref['angle'])
+            dxfattribs['rotation'] = math.degrees(ref['angle'])
         if ref['magnification'] is not None:
             dxfattribs['xscale'] = dxfattribs['yscale'] = ref['magnification']
         if ref['x_reflection']:
@@ -23,53 +30,60 @@ def _add_cell_to_dxf(block, cell, max_points, max_line_points):
         block.add_blockref(ref['cell'].name, ref['origin'], dxfattribs)
 
 
-def write_cell_to_dxf_file(outfile, cell, max_points=4000, max_line_points=4000, parallel=False):
+def write_cell_to_dxf_file(outfile, cell, max_points=4000, max_line_points=4000, parallel=False, max_workers=None):
     """
     Writes the cell to a dxf-file
 
-    :param outfile: file to write to
+    :param outfile: file to write to. If the file is opened in binary mode ('wb'), a binary dxf-file is written,
+        which is considerably smaller and faster to write than an ASCII dxf-file
     :param cell: cell to export
     :param max_points: maximum number of points for a polygon
     :param max_line_points: maximum number of points for a line
     :param parallel: export if parallelized if true
+    :param max_workers: If parallel is True, this can be used to limit the number of parallel processes
     :return:
     """
     cells = []
-    cell_names = []
+    cell_names = {}
     layers_and_datatypes = {}
 
     dxf = ezdxf.new('R2010')
     msp = dxf.modelspace()
     msp.add_blockref(cell.name, (0, 0))
 
-    def add_cells_to_unique_list(start_cell):
-        cells.append(start_cell)
-        cell_names.append(start_cell.name)
-        for c in start_cell.cells:
-            if c not in cells:
-                if c['cell'].name in cell_names:
-                    raise RuntimeError(
-                        'Each cell name must be unique, "{}" is used more than once'.format(c['cell'].name))
-                add_cells_to_unique_list(c['cell'])
-                for layer in c['cell'].layer_dict.keys():
-                    if layer not in layers_and_datatypes:
-                        layers_and_datatypes[layer] = {layer}  # second "layer" refers to the datatype
-                    elif layer not in layers_and_datatypes[layer]:
-                        layers_and_datatypes[layer].add(layer)  # second "layer" refers to the datatype
-
-    add_cells_to_unique_list(cell)
-
-    for layer, datatypes in layers_and_datatypes.items():
-        for datatype in datatypes:
-            dxf.layers.new(name='{:d}-{:d}'.format(layer, datatype))
-
+    stack = [cell]
+    while stack:
+        current_cell = stack.pop()
+        if current_cell.name in cell_names:
+            if cell_names[current_cell.name] is not current_cell:
+                raise RuntimeError(
+                    'Each cell name must be unique, "{}" is used more than once'.format(current_cell.name))
+            continue
+        cells.append(current_cell)
+        cell_names[current_cell.name] = current_cell
+        for layer in current_cell.layer_dict.keys():
+            layers_and_datatypes.setdefault(layer, set()).add(layer)  # second "layer" refers to the datatype
+        stack.extend(c['cell'] for c in reversed(current_cell.cells))
+
+    layer_names = {(layer, datatype): '{:d}-{:d}'.format(layer, datatype)
+                   for layer, datatypes in layers_and_datatypes.items() for datatype in datatypes}
+    for layer_name in layer_names.values():
+        dxf.layers.new(name=layer_name)
+
+    # Fracturing is done in parallel if requested, the dxf-blocks have to be created sequentially
     if parallel:
-        import warnings
-        warnings.warn('Parallel dxf-export is not yet implemented, ignoring parallel flag.')
-    for c in cells[::-1]:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            num = len(cells)
+            fractured_layer_dicts = list(pool.map(_fracture_cell, cells, (max_points,) * num,
+                                                  (max_line_points,) * num))
+    else:
+        fractured_layer_dicts = [_fracture_cell(c, max_points, max_line_points) for c in cells]
+
+    for c, fractured_layer_dict in zip(cells[::-1], fractured_layer_dicts[::-1]):
         block = dxf.blocks.new(c.name)
-        _add_cell_to_dxf(block, c, max_points, max_line_points)
-    dxf.write(outfile)
+        _add_cell_to_dxf(block, c, fractured_layer_dict, layer_names)
+    dxf.write(outfile, fmt='asc' if isinstance(outfile, io.TextIOBase) else 'bin')
 
 
 if __name__ == '__main__':
@@ -91,5 +105,5 @@ if __name__ == '__main__':
 
     device_cell.add_cell(sub_cell, origin=(10, 10), angle=np.pi / 2)
 
-    with open('dxf_export.dxf', 'w') as file:
+    with open('dxf_export.dxf', 'wb') as file:
         write_cell_to_dxf_file(file, device_cell, parallel=True)
@@ -3,116 +3,380 @@ For documentation of GDSII see:
 http://bitsavers.informatik.uni-stuttgart.de/pdf/calma/GDS_II_Stream_Format_Manual_6.0_Feb87.pdf
 """
 
+import io
+import os
+import itertools
 import math
 import datetime
+import shutil
+from functools import lru_cache
 from struct import pack
-from io import BytesIO
+from tempfile import SpooledTemporaryFile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import numpy as np
 
 from shapely.geometry import Polygon, LineString
 
+try:
+    from numba import njit
+except ImportError:
+    njit = None
 
+
+_BOUNDARY = 0x0800  # BOUNDARY record type
+_PATH = 0x0900  # PATH record type
+_ENDEL = pack('>2H', 4, 0x1100)  # ENDEL NO_DATA
+_SREF = pack('>2H', 4, 0x0A00)  # SREF NO_DATA
+_AREF = pack('>2H', 4, 0x0B00)  # AREF NO_DATA
+_SREF_XY = pack('>2H', 12, 0x1003)  # XY INTEGER_4 origin
+_AREF_XY = pack('>2H', 28, 0x1003)  # XY INTEGER_4 origin edge_x edge_y
+
+_IOV_MAX = 1024  # Maximum number of buffers written by a single scatter-gather write
+
+
+_HEADER_CACHE = {}
+
+
+def _element_header(element, layer, datatype):
+    """
+    Returns the records starting an element of the given type on the given layer and datatype.
+    The headers are interned, as they are the same for all elements of a type on a layer.
+    """
+    header = _HEADER_CACHE.get((element, layer, datatype))
+    if header is None:
+        header = _HEADER_CACHE[element, layer, datatype] = pack('>8H', 4, element,  # BOUNDARY/PATH NO_DATA
+                                                                6, 0x0D02, layer,  # LAYER INTEGER_2 layer
+                                                                6, 0x0E02, datatype)  # DATATYPE INTEGER_2 datatype
+    return header
+
+
+def _get_coordinates(geometry):
+    """
+    Returns the x and y coordinates of a shapely LineString or LinearRing as (N, 2)-array.
+    """
+    coords = np.asarray(geometry.coords, dtype=np.float64)
+    return coords[:, :2] if coords.size else np.empty((0, 2))
+
+
+@lru_cache(maxsize=8192)
+def _sname(name):
+    name = name + '\0' * (len(name) % 2)
+    return pack('>2H', 4 + len(name), 0x1206) + name.encode('ascii')  # SNAME STRING ref_cell_name
+
+
+@lru_cache(maxsize=8192)
 def _real_to_8byte(value):
     if value == 0:
         return b'\x00' * 8
     exponent = int((math.log(abs(value), 16) + 1) // 1)
     mantissa = int(abs(value) * 16. ** (14 - exponent))
-    return ((((0b1 if value < 0 else 0b0) + exponent + 64) << 56) + mantissa).to_bytes(8, 'big')
-
-
-def _cell_to_gdsii_binary(cell, grid_steps_per_unit, max_points, max_line_points, timestamp):
-    with BytesIO() as b:
-        b.write(pack('>14H', 28, 0x0502, *timestamp.timetuple()[:6] * 2))
-        # BGNSTR INTEGER_2 time_modification time_last_access
-        name = cell.name + '\0' * (len(cell.name) % 2)
-        b.write(pack('>2H', 4 + len(name), 0x0606) + name.encode('ascii'))  # STRNAME STRING cell_name
-
-        for layer, polygons in cell.get_fractured_layer_dict(max_points, max_line_points).items():
-            for shapely_object in polygons:
-                if isinstance(shapely_object, Polygon):
-                    if shapely_object.interiors:
-                        raise AssertionError('GDSII only supports polygons without holes')
-                    coords = list(shapely_object.exterior.coords) + [shapely_object.exterior.coords[0]]
-                    b.write(pack('>8H', 4, 0x0800,  # BOUNDARY NO_DATA
-                                 6, 0x0D02, (layer if isinstance(layer, int) else layer[0]),  # LAYER INTEGER_2 layer
-                                 6, 0x0E02,
-                                 (layer if isinstance(layer, int) else layer[1])))  # DATATYPE INTEGER_2 datatype
-                elif isinstance(shapely_object, LineString):
-                    coords = shapely_object.coords
-                    b.write(pack('>8H', 4, 0x0900,  # PATH NO_DATA
-                                 6, 0x0D02, (layer if isinstance(layer, int) else layer[0]),  # LAYER INTEGER_2 layer
-                                 6, 0x0E02,
-                                 (layer if isinstance(layer, int) else layer[1])))  # DATATYPE INTEGER_2 datatype
-                    if hasattr(shapely_object, 'width'):
-                        b.write(pack('>2Hi', 8, 0x0F03, round(shapely_object.width * grid_steps_per_unit)))
-                else:
-                    import warnings
-                    warnings.warn(
-                        'Shapely object of type ' + str(
-                            type(shapely_object)) + ' not convertible to GDSII, skipping...')
-                    continue
-
-                xy = np.round(np.array(coords) * grid_steps_per_unit).astype('>i4')
-                for start in range(0, xy.shape[0], 8191):  # Split in Blocks of 8191 points
-                    stop = min(start + 8191, xy.shape[0])
-                    b.write(pack('>2H', 4 + 8 * (stop - start), 0x1003))  # XY INTEGER_4
-                    b.write(xy[start:stop].tobytes())  # coords of shapely_object
-                b.write(pack('>2H', 4, 0x1100))  # ENDEL NO_DATA
-
-        for ref in cell.cells:
-            aref = not (ref['columns'] == 1 and ref['rows'] == 1 and not ref['spacing'])
-            name = ref['cell'].name + '\0' if len(ref['cell'].name) % 2 != 0 else ref['cell'].name
-            if aref:
-                b.write(pack('>2H', 4, 0x0B00))  # AREF NO_DATA
+    return ((((0b10000000 if value < 0 else 0b0) + exponent + 64) << 56) + mantissa).to_bytes(8, 'big')
+
+
+def _real_to_8byte_array_numpy(values):
+    abs_values = np.abs(values)
+    nonzero = abs_values != 0
+    with np.errstate(divide='ignore'):
+        exponent = np.where(nonzero, np.floor(np.log(abs_values) / np.log(16) + 1), 0).astype(np.int64)
+    mantissa = (abs_values * 16. ** (14 - exponent)).astype(np.uint64)
+    words = (((values < 0).astype(np.uint64) << np.uint64(63)) | ((exponent + 64).astype(np.uint64) << np.uint64(56))
+             | mantissa)
+    return np.where(nonzero, words, np.uint64(0))
+
+
+if njit is not None:
+    @njit(cache=True)
+    def _real_to_8byte_bulk(values, out):
+        for i in range(values.size):
+            value = values[i]
+            if value == 0:
+                out[i] = 0
+                continue
+            abs_value = abs(value)
+            exponent = int(math.floor(math.log(abs_value) / math.log(16) + 1))
+            mantissa = np.uint64(abs_value * 16. ** (14 - exponent))
+            sign = np.uint64(1 << 63) if value < 0 else np.uint64(0)
+            out[i] = sign | (np.uint64(exponent + 64) << np.uint64(56)) | mantissa
+
+    @njit(cache=True)
+    def _scale_coordinates(coords, grid_steps_per_unit, closed, out):
+        """
+        Scales and rounds the coordinates and stores them byte-swapped in `out`, i.e. the memory of `out` contains the
+        big-endian int32 representation. If closed, the first point is repeated at the end.
+        """
+        for i in range(coords.shape[0] + closed):
+            for j in range(2):
+                value = np.uint32(np.int32(np.rint(coords[i % coords.shape[0], j] * grid_steps_per_unit)))
+                out[i, j] = (((value & np.uint32(0xFF)) << np.uint32(24))
+                             | ((value & np.uint32(0xFF00)) << np.uint32(8))
+                             | ((value >> np.uint32(8)) & np.uint32(0xFF00))
+                             | (value >> np.uint32(24)))
+
+
+def _real_to_8byte_array(values):
+    """
+    Vectorized version of _real_to_8byte, returns the concatenated REAL_8 representations of all values.
+    If numba is installed, the conversion is done by a compiled loop.
+    """
+    values = np.ascontiguousarray(values, dtype=np.float64).ravel()
+    if njit is None:
+        return _real_to_8byte_array_numpy(values).astype('>u8').tobytes()
+    out = np.empty(values.size, dtype=np.uint64)
+    _real_to_8byte_bulk(values, out)
+    return out.astype('>u8').tobytes()
+
+
+def _write_buffers(outfile, buffers):
+    """
+    Writes all buffers to the file. Files on disk are written by scatter-gather writes if supported by the operating
+    system, which avoids joining the buffers into a single bytes object. Buffered files are only written this way
+    if they are seekable, as their position has to be synchronized with the file descriptor afterwards.
+    """
+    if not hasattr(os, 'writev') or not (isinstance(outfile, io.FileIO) or
+                                         (isinstance(outfile, io.BufferedWriter) and outfile.seekable())):
+        outfile.write(b''.join(buffers))
+        return
+
+    outfile.flush()
+    fd = outfile.fileno()
+    for i in range(0, len(buffers), _IOV_MAX):
+        chunk = buffers[i:i + _IOV_MAX]
+        written = os.writev(fd, chunk)
+        if written < sum(len(buffer) for buffer in chunk):  # Write the rest in case of a partial write
+            remaining = b''.join(chunk)[written:]
+            while remaining:
+                remaining = remaining[os.write(fd, remaining):]
+    if isinstance(outfile, io.BufferedWriter):
+        # The file descriptor has been written directly, the buffered file has to continue at its new position
+        outfile.seek(os.lseek(fd, 0, os.SEEK_CUR))
+
+
+def _references(cell):
+    """
+    Returns the references of the cell, the referenced cells are replaced by their names.
+    In contrast to the cell itself, these can be pickled without pickling the whole cell tree.
+    """
+    return [dict(ref, cell=ref['cell'].name) for ref in cell.cells]
+
+
+def _cell_records(name, fractured_layer_dict, refs, grid_steps_per_unit, timestamp):
+    """
+    Generates the records of a cell, yields lists of at least _IOV_MAX buffers, except for the last one.
+    """
+    name = name + '\0' * (len(name) % 2)
+    buffers = [pack('>14H', 28, 0x0502, *timestamp.timetuple()[:6] * 2),
+               # BGNSTR INTEGER_2 time_modification time_last_access
+               pack('>2H', 4 + len(name), 0x0606) + name.encode('ascii')]  # STRNAME STRING cell_name
+
+    # Scratch buffers for the scaled coordinates, reused for all shapes and enlarged if necessary
+    float_buffer = np.empty((0, 2), dtype=np.float64)
+    int_buffer = np.empty((0, 2), dtype='>i4')
+
+    for layer, polygons in fractured_layer_dict.items():
+        polygons = iter(polygons)
+        first = next(polygons, None)
+        if first is None:  # Layers without shapes are skipped, their keys don't need to be valid layers
+            continue
+        layer, datatype = (layer, layer) if isinstance(layer, int) else layer
+        boundary_header = _element_header(_BOUNDARY, layer, datatype)
+        path_header = _element_header(_PATH, layer, datatype)
+        for shapely_object in itertools.chain((first,), polygons):
+            if isinstance(shapely_object, Polygon):
+                if shapely_object.interiors:
+                    raise AssertionError('GDSII only supports polygons without holes')
+                coords = _get_coordinates(shapely_object.exterior)
+                closed = True
+                parts = [boundary_header]
+            elif isinstance(shapely_object, LineString):
+                coords = _get_coordinates(shapely_object)
+                closed = False
+                parts = [path_header]
+                if hasattr(shapely_object, 'width'):
+                    parts.append(pack('>2Hi', 8, 0x0F03, round(shapely_object.width * grid_steps_per_unit)))
+            else:
+                import warnings
+                warnings.warn(
+                    'Shapely object of type ' + str(
+                        type(shapely_object)) + ' not convertible to GDSII, skipping...')
+                continue
+
+            n = coords.shape[0] + closed
+            if n > float_buffer.shape[0]:
+                float_buffer = np.empty((n, 2), dtype=np.float64)
+                int_buffer = np.empty((n, 2), dtype='>i4')
+            xy = int_buffer[:n]
+            if njit is not None and n >= 64:  # For small shapes, the call overhead dominates
+                _scale_coordinates(np.ascontiguousarray(coords), float(grid_steps_per_unit), closed,
+                                   xy.view(np.uint32))
             else:
-                b.write(pack('>2H', 4, 0x0A00))  # SREF NO_DATA
-            b.write(pack('>2H', 4 + len(name), 0x1206) + name.encode('ascii'))  # SNAME STRING ref_cell_name
-            if (ref['angle'] is not None) or (ref['magnification'] is not None) or ref['x_reflection']:
-                b.write(pack('>3H', 6, 0x1A01, 1 << 15 if ref['x_reflection'] else 0))  # STRANS BIT_ARRAY bit15=1
-                if ref['magnification'] is not None:
-                    b.write(pack('>2H', 12, 0x1B05) + _real_to_8byte(ref['magnification']))  # MAG REAL_8
-                if ref['angle'] is not None:
-                    b.write(pack('>2H', 12, 0x1C05) + _real_to_8byte(np.rad2deg(ref['angle']) % 360.))  # ANGLE REAL_8
-            if aref:
-                b.write(pack('>2H2h', 8, 0x1302, ref['columns'], ref['rows']))  # COLROW INTEGER_2 spacing
-            b.write(pack('>2H', 28 if aref else 12, 0x1003) + np.round(
-                np.array(ref['origin']) * grid_steps_per_unit).astype(
-                '>i4').tobytes())  # XY INTEGER_8 origin
-            if aref:
-                b.write((np.round((np.array((ref['spacing'][0] * ref['columns'], 0)) +
-                                   np.array(ref['origin'])) * grid_steps_per_unit)).astype(
-                    '>i4').tobytes())  # XY INTEGER_8 edge_x
-                b.write((np.round((np.array((0, ref['spacing'][1] * ref['rows'])) +
-                                   np.array(ref['origin'])) * grid_steps_per_unit)).astype(
-                    '>i4').tobytes())  # XY INTEGER_8 edge_y
-
-            b.write(pack('>2H', 4, 0x1100))  # ENDEL NO_DATA
-
-        b.write(pack('>2H', 4, 0x0700))  # ENDEST NO_DATA
-
-        return b.getvalue()
+                scaled = float_buffer[:n]
+                np.multiply(coords, grid_steps_per_unit, out=scaled[:coords.shape[0]])
+                if closed:
+                    scaled[-1] = scaled[0]
+                np.rint(scaled, out=scaled)
+                np.copyto(xy, scaled, casting='unsafe')
+            if xy.shape[0] <= 8191:
+                parts += [pack('>2H', 4 + 8 * xy.shape[0], 0x1003), xy.tobytes()]  # XY INTEGER_4
+            else:  # Split in Blocks of 8191 points
+                starts = np.arange(0, xy.shape[0], 8191)
+                headers = np.stack((4 + 8 * np.minimum(8191, xy.shape[0] - starts),
+                                    np.full_like(starts, 0x1003)), axis=1).astype('>u2')  # XY INTEGER_4
+                for header, start in zip(headers, starts):
+                    parts += [header.tobytes(), xy[start:start + 8191].tobytes()]
+            parts.append(_ENDEL)
+            buffers += parts
+            if len(buffers) >= _IOV_MAX:
+                yield buffers
+                buffers = []
+
+    arefs = [not (ref['columns'] == 1 and ref['rows'] == 1 and not ref['spacing']) for ref in refs]
+    if refs:
+        # Origin, edge_x and edge_y of all references, the edges are only used for arrays
+        points = np.empty((len(refs), 3, 2), dtype=np.float64)
+        points[:] = np.array([ref['origin'] for ref in refs], dtype=np.float64).reshape(-1, 1, 2)
+        extents = np.array([(ref['spacing'][0] * ref['columns'], ref['spacing'][1] * ref['rows']) if aref else (0, 0)
+                            for ref, aref in zip(refs, arefs)], dtype=np.float64)
+        points[:, 1, 0] += extents[:, 0]
+        points[:, 2, 1] += extents[:, 1]
+        points = np.round(points * grid_steps_per_unit).astype('>i4')
+        # REAL_8 representations of the magnification and the angle of all references, 16 bytes per reference
+        reals = _real_to_8byte_array([(1. if ref['magnification'] is None else ref['magnification'],
+                                       0. if ref['angle'] is None else math.degrees(ref['angle']) % 360.)
+                                      for ref in refs])
+    for i, (ref, aref, ref_points) in enumerate(zip(refs, arefs, points if refs else ())):
+        if len(buffers) >= _IOV_MAX:
+            yield buffers
+            buffers = []
+
+        if not aref and ref['angle'] is None and ref['magnification'] is None and not ref['x_reflection']:
+            buffers += (_SREF, _sname(ref['cell']), _SREF_XY, ref_points[0].tobytes(), _ENDEL)
+            continue
+
+        parts = [_AREF if aref else _SREF, _sname(ref['cell'])]
+        if (ref['angle'] is not None) or (ref['magnification'] is not None) or ref['x_reflection']:
+            parts.append(pack('>3H', 6, 0x1A01, 1 << 15 if ref['x_reflection'] else 0))  # STRANS BIT_ARRAY bit15=1
+            if ref['magnification'] is not None:
+                parts += [pack('>2H', 12, 0x1B05), reals[16 * i:16 * i + 8]]  # MAG REAL_8
+            if ref['angle'] is not None:
+                parts += [pack('>2H', 12, 0x1C05), reals[16 * i + 8:16 * i + 16]]  # ANGLE REAL_8
+        if aref:
+            parts += [pack('>2H2h', 8, 0x1302, ref['columns'], ref['rows']),  # COLROW INTEGER_2 spacing
+                      _AREF_XY, ref_points.tobytes()]  # XY INTEGER_4 origin edge_x edge_y
+        else:
+            parts += [_SREF_XY, ref_points[0].tobytes()]  # XY INTEGER_4 origin
+        parts.append(_ENDEL)
+        buffers += parts
+
+    buffers.append(pack('>2H', 4, 0x0700))  # ENDEST NO_DATA
+    yield buffers
+
+
+def _write_cell_to_gdsii(outfile, name, fractured_layer_dict, refs, grid_steps_per_unit, timestamp):
+    for buffers in _cell_records(name, fractured_layer_dict, refs, grid_steps_per_unit, timestamp):
+        _write_buffers(outfile, buffers)
+
+
+def _cell_to_gdsii_binary(name, fractured_layer_dict, refs, grid_steps_per_unit, timestamp):
+    binary = bytearray()
+    for buffers in _cell_records(name, fractured_layer_dict, refs, grid_steps_per_unit, timestamp):
+        for buffer in buffers:
+            binary += buffer
+    return binary
+
+
+def _layers_to_gdsii_binary(name, layer_dict, refs, grid_steps_per_unit, max_points, max_line_points, timestamp):
+    """
+    Fractures the geometries of a cell and returns the records of the cell.
+    Only the layers and references of the cell itself are passed, so the workers of a process pool neither get the
+    whole cell tree pickled nor the fractured polygons, which are returned as records instead.
+    """
+    from gdshelpers.geometry.chip import _iter_fractured_layer  # Imported here, as the chip module imports this one
+
+    fractured_layer_dict = {layer: _iter_fractured_layer(geometries, max_points, max_line_points)
+                            for layer, geometries in layer_dict.items()}
+    return _cell_to_gdsii_binary(name, fractured_layer_dict, refs, grid_steps_per_unit, timestamp)
+
+
+def _cell_to_gdsii_spooled_file(cell, grid_steps_per_unit, max_points, max_line_points, timestamp,
+                                fracture_executor=None):
+    """
+    Writes the cell to a temporary file, which is kept in memory for small cells and rolled over to disk for big ones.
+    The returned file is positioned at its start.
+    """
+    f = SpooledTemporaryFile(max_size=16 << 20)
+    _write_cell_to_gdsii(f, cell.name, cell.get_fractured_layer_dict(max_points, max_line_points, fracture_executor,
+                                                                     lazy=True),
+                         _references(cell), grid_steps_per_unit, timestamp)
+    f.seek(0)
+    return f
+
+
+def _write_cells(outfile, cells, grid_steps_per_unit, max_points, max_line_points, timestamp, parallel, max_workers,
+                 use_processes, fracture_executor):
+    if parallel:
+        num = len(cells)
+        if use_processes:
+            # The cells are fractured by the workers, which only get the layers and references of their cell.
+            # Temporary files can't be passed between processes, therefore the workers return bytes.
+            with ProcessPoolExecutor(max_workers=max_workers) as pool:
+                for binary in pool.map(_layers_to_gdsii_binary, [c.name for c in cells], [c.layer_dict for c in cells],
+                                       [_references(c) for c in cells], (grid_steps_per_unit,) * num,
+                                       (max_points,) * num, (max_line_points,) * num, (timestamp,) * num):
+                    outfile.write(binary)
+        else:
+            with ThreadPoolExecutor(max_workers=max_workers) as pool:
+                for f in pool.map(_cell_to_gdsii_spooled_file, cells, (grid_steps_per_unit,) * num, (max_points,) * num,
+                                  (max_line_points,) * num, (timestamp,) * num, (fracture_executor,) * num):
+                    with f:
+                        shutil.copyfileobj(f, outfile)
+    else:
+        for c in cells:
+            # The geometries are fractured while writing, so they don't have to be kept in memory
+            _write_cell_to_gdsii(outfile, c.name, c.get_fractured_layer_dict(max_points, max_line_points,
+                                                                             fracture_executor, lazy=True),
+                                 _references(c), grid_steps_per_unit, timestamp)
 
 
 def write_cell_to_gdsii_file(outfile, cell, unit=1e-6, grid_steps_per_unit=1000, max_points=4000, max_line_points=4000,
-                             timestamp=None, parallel=False, max_workers=None):
+                             timestamp=None, parallel=False, max_workers=None, use_processes=True,
+                             intra_cell_parallel=False):
+    """
+    Writes the cell and all its sub-cells to a GDSII-file
+
+    :param outfile: file to write to, has to be opened in binary mode
+    :param cell: cell to export
+    :param unit: unit of the coordinates in meters
+    :param grid_steps_per_unit: number of grid steps per unit
+    :param max_points: maximum number of points for a polygon
+    :param max_line_points: maximum number of points for a line
+    :param timestamp: timestamp written to the file, defaults to the current time
+    :param parallel: the cells are converted in parallel if true
+    :param max_workers: If parallel is True, this can be used to limit the number of parallel workers
+    :param use_processes: If parallel or intra_cell_parallel is True, use process pools instead of thread pools.
+        Threads avoid pickling the geometries, but shapely < 2.0 holds the GIL for most of the fracturing, so
+        only processes fracture the cells in parallel.
+    :param intra_cell_parallel: If True, the layers of each cell are fractured in parallel by a separate pool.
+        With threads, this is only beneficial if shapely releases the GIL during fracturing.
+        It has no effect if parallel and use_processes are True, as the cells are already fractured by the workers.
+    """
     name = 'gdshelpers_exported_library'
     grid_step_unit = unit / grid_steps_per_unit
     timestamp = datetime.datetime.now() if timestamp is None else timestamp
 
-    cells = []
-    cell_names = []
-
-    def add_cells_to_unique_list(start_cell):
-        cells.append(start_cell)
-        cell_names.append(start_cell.name)
-        for c in start_cell.cells:
-            if c['cell'] not in cells:
-                if c['cell'].name in cell_names:
-                    raise AssertionError(
-                        'Each cell name must be unique, "{}" is used more than once'.format(c['cell'].name))
-                add_cells_to_unique_list(c['cell'])
+    # Cells keyed by their id in the order of their first occurrence, independent of Cell.__eq__/__hash__
+    unique_cells = {}
+    cell_names = {}
 
-    add_cells_to_unique_list(cell)
+    stack = [cell]
+    while stack:
+        current_cell = stack.pop()
+        if id(current_cell) in unique_cells:
+            continue
+        if cell_names.setdefault(current_cell.name, id(current_cell)) != id(current_cell):
+            raise AssertionError('Each cell name must be unique, "{}" is used more than once'.format(current_cell.name))
+        unique_cells[id(current_cell)] = current_cell
+        stack.extend(c['cell'] for c in reversed(current_cell.cells) if id(c['cell']) not in unique_cells)
+    cells = list(unique_cells.values())
 
     name = name + '\0' * (len(name) % 2)  # Strings always have even length
     outfile.write(pack('>3H', 6, 0x0002, 0x258))  # HEADER INTEGER_2 v6.0
@@ -121,16 +385,15 @@ def write_cell_to_gdsii_file(outfile, cell, unit=1e-6, grid_steps_per_unit=1000,
     outfile.write(pack('>2H', 4 + len(name), 0x0206) + name.encode('ascii'))  # LIBNAME STRING libname
     outfile.write(pack('>2H', 20, 0x0305) + _real_to_8byte(grid_step_unit / unit) + _real_to_8byte(grid_step_unit))
     # UNITS REAL_8 1/grid_steps_per_unit grid_step_unit
-    if parallel:
-        from concurrent.futures import ProcessPoolExecutor
-        with ProcessPoolExecutor(max_workers=max_workers) as pool:
-            num = len(cells)
-            for binary in pool.map(_cell_to_gdsii_binary, cells, (grid_steps_per_unit,) * num, (max_points,) * num,
-                                   (max_line_points,) * num, (timestamp,) * num):
-                outfile.write(binary)
-    else:
-        for c in cells:
-            outfile.write(_cell_to_gdsii_binary(c, grid_steps_per_unit, max_points, max_line_points, timestamp))
+    fracture_executor = None
+    if intra_cell_parallel and not (parallel and use_processes):
+        fracture_executor = (ProcessPoolExecutor if use_processes else ThreadPoolExecutor)(max_workers=max_workers)
+    try:
+        _write_cells(outfile, cells, grid_steps_per_unit, max_points, max_line_points, timestamp, parallel,
+                     max_workers, use_processes, fracture_executor)
+    finally:
+        if fracture_executor:
+            fracture_executor.shutdown()
     outfile.write(pack('>2H', 4, 0x0400))  # ENDLIB N0_DATA
 
 
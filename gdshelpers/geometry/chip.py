@@ -1,16 +1,156 @@
+import copy
+import importlib
+import io
 import itertools
 import json
+import math
+import os
+import sys
 import numpy as np
 from typing import List, Optional
-from shapely.affinity import translate, rotate
+from shapely.affinity import affine_transform
 from shapely.geometry import box
 
-from gdshelpers.geometry.shapely_adapter import convert_to_layout_objs, bounds_union, transform_bounds
+from gdshelpers.geometry.shapely_adapter import convert_to_layout_objs_batch, bounds_union, transform_bounds_array, \
+    rotate_points, shapely_collection_to_basic_objs, fracture_intelligently
 from gdshelpers.export.gdsii_export import write_cell_to_gdsii_file
 from gdshelpers.geometry import geometric_union
 from gdshelpers.parts.port import Port
 import gdshelpers.helpers.layers as std_layers
 
+_versions = itertools.count()
+_latest_version = next(_versions)  # The most recently issued version of any cell
+_CONVERT_BATCH_SIZE = 64  # Number of geometries converted in one task when creating gdspy or OASIS cells in parallel
+
+
+def _new_version():
+    global _latest_version
+    _latest_version = next(_versions)
+    return _latest_version
+
+
+def _dump_json(data, f, indent=None):
+    # Without indentation, the C-encoder of the json-module can be used
+    json.dump(data, f, ensure_ascii=False, indent=indent, separators=(',', ': ') if indent else (',', ':'))
+
+
+def _import_modules(*modules):
+    # Initializer of worker processes, imports the export libraries before the first task arrives
+    for module in modules:
+        importlib.import_module(module)
+
+
+def _process_pool(max_workers, *modules):
+    """
+    Returns a ProcessPoolExecutor whose workers import the given modules before the first task arrives.
+    Initializers are only supported since Python 3.7, before that the modules are imported by the first task.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    if sys.version_info >= (3, 7):
+        return ProcessPoolExecutor(max_workers=max_workers, initializer=_import_modules, initargs=modules)
+    return ProcessPoolExecutor(max_workers=max_workers)
+
+
+def _convert_layer(cache, executor, geometries, layer, datatype=None, **kwargs):
+    """
+    Converts the `geometries` of a layer using convert_to_layout_objs_batch. Each geometry is only converted once
+    for each layer and datatype in `cache`. If `executor` is given, the geometries are submitted in batches of
+    `_CONVERT_BATCH_SIZE`.
+
+    Returns a tuple (result, index) for each geometry, the converted objects of the geometry are `result[index]`.
+    If `executor` is given, result is a future.
+    """
+    # Shapely objects can't be hashed by content cheaply, the cache keeps a reference to geometry to keep its id valid
+    new_geometries = list({id(geometry): geometry for geometry in geometries
+                           if (id(geometry), layer, datatype) not in cache}.values())
+    batch_size = _CONVERT_BATCH_SIZE if executor else max(len(new_geometries), 1)
+    for start in range(0, len(new_geometries), batch_size):
+        batch = new_geometries[start:start + batch_size]
+        if executor:
+            result = executor.submit(convert_to_layout_objs_batch, batch, layer, datatype=datatype, **kwargs)
+        else:
+            result = convert_to_layout_objs_batch(batch, layer, datatype=datatype, **kwargs)
+        for index, geometry in enumerate(batch):
+            cache[id(geometry), layer, datatype] = (geometry, result, index)
+    return [cache[id(geometry), layer, datatype][1:] for geometry in geometries]
+
+
+def _iter_fractured_layer(geometries, max_points, max_line_points):
+    # Fractures one geometry after the other while iterating
+    for geometry in geometries:
+        geometry = geometry.get_shapely_object() if hasattr(geometry, 'get_shapely_object') else geometry
+        if type(geometry) in [list, tuple]:
+            geometry = geometric_union(geometry)
+        for geo in shapely_collection_to_basic_objs(geometry):
+            if not geo.is_empty:
+                yield from fracture_intelligently(geo, max_points, max_line_points)
+
+
+def _fracture_layer(geometries, max_points, max_line_points):
+    # Module level function returning a list, so it can be run by thread as well as by process pools
+    return list(_iter_fractured_layer(geometries, max_points, max_line_points))
+
+
+def _serialize_oasis_cell(cell):
+    from fatamorgana.records import Modals
+
+    stream = io.BytesIO()
+    cell.dedup_write(stream, Modals())
+    return stream.getvalue()
+
+
+class _SerializedOasisCell:
+    """
+    Stands in for a fatamorgana.Cell in a fatamorgana.OasisLayout, writing the already serialized cell.
+    """
+
+    def __init__(self, data: bytes):
+        self.data = data
+
+    def dedup_write(self, stream, modals):
+        return stream.write(self.data)
+
+
+def _polygons_to_path(geometries, origin, angle):
+    """
+    Creates a single matplotlib path containing all polygons of `geometries`, rotated by `angle` and moved to `origin`.
+    Exteriors are oriented counter-clockwise and interiors clockwise, so overlapping polygons are filled and holes are
+    kept with the nonzero winding rule. Returns `None` if there are no polygons.
+    """
+    from matplotlib.path import Path
+
+    rings, exterior = [], []
+    stack = list(geometries)
+    while stack:
+        geometry = stack.pop()
+        geometry = geometry.get_shapely_object() if hasattr(geometry, 'get_shapely_object') else geometry
+        if hasattr(geometry, 'geoms'):
+            stack.extend(geometry.geoms)
+        elif geometry.geom_type == 'Polygon' and not geometry.is_empty:
+            rings.append(np.asarray(geometry.exterior.coords)[:, :2])
+            rings.extend(np.asarray(interior.coords)[:, :2] for interior in geometry.interiors)
+            exterior += [True] + [False] * len(geometry.interiors)
+    if not rings:
+        return None
+
+    lengths = np.array([len(ring) for ring in rings])
+    ends = np.cumsum(lengths)
+    starts = ends - lengths
+    vertices = np.concatenate(rings)
+
+    # Signed areas of all rings, the terms connecting the end of a ring with the start of the next one are dropped
+    cross = np.zeros(len(vertices))
+    cross[:-1] = vertices[:-1, 0] * vertices[1:, 1] - vertices[1:, 0] * vertices[:-1, 1]
+    cross[ends - 1] = 0
+    for i in np.flatnonzero((np.add.reduceat(cross, starts) > 0) != np.array(exterior)):
+        vertices[starts[i]:ends[i]] = vertices[starts[i]:ends[i]][::-1]
+
+    vertices = rotate_points(vertices, angle, origin)
+    codes = np.full(len(vertices), Path.LINETO, dtype=Path.code_type)
+    codes[starts] = Path.MOVETO
+    codes[ends - 1] = Path.CLOSEPOLY
+    return Path(vertices, codes)
+
 
 class Cell:
     def __init__(self, name: str):
@@ -21,6 +161,7 @@ class Cell:
         """
         self.name = name
         self.cells = []
+        self._child_names = set()  # Names of the cells in `cells`
         self.layer_dict = {}
         self.dlw_data = {}
         self.desc = {'dlw': self.dlw_data, 'desc': {}, 'ebl': []}
@@ -28,9 +169,25 @@ class Cell:
         self.cell_oasis = None
         self._bounds = None
         # Only contains the bounds of items in `layer_dict`.
-        # Children cells have to be queried each time, since there is no way of knowing when they got changed.
         # self._bounds is None if the bounds need to be recalculated or if the cell is empty (in which case
         # recalculating them is cheap and we don't need to cache them)
+        self._layer_bounds = {}
+        # Buffers with the bounds of the geometries of each layer, see _get_layer_bounds
+        self._reduced_layers = {}
+        # Results of get_reduced_layer together with the version they have been calculated for
+        self._part_layers = set()
+        # Layers containing parts, which might still be modified after being added, their results aren't cached
+        self._rolled_up_part_layers = None
+        # Result of _get_part_layers together with the version it has been calculated for
+        self._dlw_data = None
+        # Result of get_dlw_data together with the version it has been calculated for
+        self._version = _new_version()
+        # Bumped by add_to_layer, add_cell and add_dlw_data, the version of the children is rolled up in get_version
+        self._rolled_up_version = None
+        # Result of get_version together with the latest version issued when it was calculated
+        self._child_bounds = {}
+        # Transformed bounds of the children, only recalculated if the version of the child,
+        # its origin or its angle changed
 
     @property
     def bounds(self):
@@ -49,24 +206,98 @@ class Cell:
         if layers is None and self._bounds is not None:
             bounds += [self._bounds]
         else:
-            for layer in layers or self.layer_dict.keys():
-                for geo in self.layer_dict.get(layer, []):
-                    geo_bounds = geo.get_shapely_object().bounds if hasattr(geo, 'get_shapely_object') else geo.bounds
-                    if geo_bounds != ():  # Some shapely geometries (collections) can return empty bounds
-                        bounds.append(geo_bounds)
-
-            # Cache envelope if we have the global envelope
-            if layers is None:
-                self._bounds = bounds_union(bounds) if len(bounds) > 0 else None
-
-        # Merge envelopes of children cells
+            envelopes = [self._get_layer_envelope(layer) for layer in layers or self.layer_dict.keys()]
+            envelopes = np.array([envelope for envelope in envelopes if envelope is not None]).reshape(-1, 4)
+            if len(envelopes) > 0:
+                bounds.append(tuple(np.concatenate((envelopes[:, :2].min(axis=0),
+                                                    envelopes[:, 2:].max(axis=0))).tolist()))
+
+            # Cache envelope if we have the global envelope and no parts, which might still be modified
+            if layers is None and not self._part_layers:
+                self._bounds = bounds[0] if len(bounds) > 0 else None
+
+        # Merge envelopes of children cells, the bounds of changed children are transformed together
+        layers_key = None if layers is None else tuple(layers)
+        changed = []
         for cell in self.cells:
-            cell_bounds = cell['cell'].get_bounds(layers)
-            if cell_bounds is not None:
-                bounds.append(transform_bounds(cell_bounds, cell['origin'], rotation=cell['angle'] or 0))
+            part_layers = cell['cell']._get_part_layers()
+            if part_layers and (layers is None or not part_layers.isdisjoint(layers)):
+                state = None  # Parts might have been modified without changing the version, so they aren't cached
+            else:
+                state = (cell['cell'], cell['cell'].get_version(), tuple(cell['origin']), cell['angle'])
+            cached = self._child_bounds.get((id(cell), layers_key))
+            if state is None or cached is None or cached[0] != state:
+                changed.append((cell, state, cell['cell'].get_bounds(layers)))
+        for cell, state, _ in changed:
+            self._child_bounds[id(cell), layers_key] = (state, None)
+        changed = [(cell, state, cell_bounds) for cell, state, cell_bounds in changed if cell_bounds is not None]
+        if changed:
+            transformed = transform_bounds_array([cell_bounds for _, _, cell_bounds in changed],
+                                                 [cell['origin'] for cell, _, _ in changed],
+                                                 [cell['angle'] or 0 for cell, _, _ in changed])
+            for (cell, state, _), cell_bounds in zip(changed, transformed.tolist()):
+                self._child_bounds[id(cell), layers_key] = (state, tuple(cell_bounds))
+        bounds += [self._child_bounds[id(cell), layers_key][1] for cell in self.cells
+                   if self._child_bounds[id(cell), layers_key][1] is not None]
 
         return bounds_union(bounds) if len(bounds) > 0 else None
 
+    def _get_layer_bounds(self, layer):
+        """
+        Returns the bounds of the geometries on the layer as (N, 4)-array.
+        Only the bounds of geometries added since the last call are calculated, they are appended to a buffer which
+        is doubled in size if it's full. The envelope of the layer is updated alongside, see _get_layer_envelope.
+        The bounds of layers containing parts are calculated on every call, as the parts might have been modified.
+        """
+        geometries = self.layer_dict.get(layer, [])
+        if layer in self._part_layers:
+            return np.array([geo_bounds for geo_bounds in
+                             (geo.get_shapely_object().bounds if hasattr(geo, 'get_shapely_object') else geo.bounds
+                              for geo in geometries)
+                             if geo_bounds != ()], dtype=float).reshape(-1, 4)
+        buffer, n_rows, n_geometries, envelope = self._layer_bounds.get(layer, (np.empty((0, 4)), 0, 0, None))
+        if n_geometries > len(geometries):  # The layer has been changed directly, calculate all bounds again
+            n_rows, n_geometries, envelope = 0, 0, None
+        if n_geometries < len(geometries):
+            new_bounds = [geo_bounds for geo_bounds in
+                          (geo.get_shapely_object().bounds if hasattr(geo, 'get_shapely_object') else geo.bounds
+                           for geo in geometries[n_geometries:])
+                          if geo_bounds != ()]  # Some shapely geometries (collections) can return empty bounds
+            if n_rows + len(new_bounds) > len(buffer):
+                buffer, old_buffer = np.empty((max(2 * len(buffer), n_rows + len(new_bounds)), 4)), buffer
+                buffer[:n_rows] = old_buffer[:n_rows]
+            if new_bounds:
+                new_rows = buffer[n_rows:n_rows + len(new_bounds)]
+                new_rows[:] = new_bounds
+                if envelope is not None:
+                    new_rows = np.vstack((envelope, new_rows))
+                envelope = np.concatenate((new_rows[:, :2].min(axis=0), new_rows[:, 2:].max(axis=0)))
+            n_rows, n_geometries = n_rows + len(new_bounds), len(geometries)
+        self._layer_bounds[layer] = buffer, n_rows, n_geometries, envelope
+        return buffer[:n_rows]
+
+    def _get_layer_envelope(self, layer):
+        """
+        Returns the envelope of the geometries on the layer as array (xmin, ymin, xmax, ymax) or `None` if it is empty.
+        Only the geometries added since the last call are visited, except for layers containing parts.
+        """
+        if layer in self._part_layers:
+            bounds = self._get_layer_bounds(layer)
+            return np.concatenate((bounds[:, :2].min(axis=0), bounds[:, 2:].max(axis=0))) if len(bounds) else None
+        self._get_layer_bounds(layer)
+        return self._layer_bounds[layer][3] if layer in self._layer_bounds else None
+
+    def get_version(self):
+        """
+        Returns a token, which changes whenever geometries, cells or DLW data are added to this cell or one of its
+        sub-cells.
+        """
+        # No version of any sub-cell can have changed as long as no new version has been issued
+        if self._rolled_up_version is None or self._rolled_up_version[0] != _latest_version:
+            self._rolled_up_version = (_latest_version,
+                                       max([self._version] + [cell['cell'].get_version() for cell in self.cells]))
+        return self._rolled_up_version[1]
+
     @property
     def size(self):
         """
@@ -86,10 +317,24 @@ class Cell:
         :param geometry: shapely geometry
         """
 
-        self._bounds = None
-        if layer not in self.layer_dict:
-            self.layer_dict[layer] = []
-        self.layer_dict[layer] += geometry
+        self._version = _new_version()
+        if any(hasattr(g, 'get_shapely_object') for g in geometry):
+            self._part_layers.add(layer)
+        geometries = self.layer_dict.setdefault(layer, [])
+        _, n_rows, n_geometries, _ = self._layer_bounds.get(layer, (None, 0, 0, None))
+        # The cached envelope can only be extended if the bounds buffer of the layer is up to date
+        update_bounds = self._bounds is not None and not self._part_layers and n_geometries == len(geometries)
+        geometries.extend(geometry)
+
+        if update_bounds:
+            new_bounds = self._get_layer_bounds(layer)[n_rows:]
+            if len(new_bounds) > 0:
+                self._bounds = (min(self._bounds[0], float(new_bounds[:, 0].min())),
+                                min(self._bounds[1], float(new_bounds[:, 1].min())),
+                                max(self._bounds[2], float(new_bounds[:, 2].max())),
+                                max(self._bounds[3], float(new_bounds[:, 3].max())))
+        else:
+            self._bounds = None
 
     def add_dlw_data(self, dlw_type, dlw_id, data):
         """
@@ -103,6 +348,7 @@ class Cell:
             self.dlw_data[dlw_type] = {}
         if dlw_id in self.dlw_data[dlw_type]:
             raise ValueError('ID "{:s}" already used'.format(dlw_id))
+        self._version = _new_version()
         self.dlw_data[dlw_type][dlw_id] = data
 
     def add_cell(self, cell, origin=(0, 0), angle: Optional[float] = None, columns=1, rows=1, spacing=None):
@@ -116,13 +362,15 @@ class Cell:
         :param rows: Number of rows
         :param spacing: Spacing between the cells, should be an array in the form [x_spacing, y_spacing]
         """
-        if cell.get_dlw_data() and cell.name in [cell_dict['cell'].name for cell_dict in self.cells]:
+        if cell.name in self._child_names and cell.get_dlw_data():
             raise ValueError(
                 'Cell name "{cell_name:s}" added multiple times to {self_name:s}.'
                 ' This is not allowed for cells containing DLW data.'.format(
                     cell_name=cell.name, self_name=self.name
                 )
             )
+        self._version = _new_version()
+        self._child_names.add(cell.name)
         self.cells.append(
             dict(cell=cell, origin=origin, angle=angle, magnification=None, x_reflection=False, columns=columns,
                  rows=rows, spacing=spacing))
@@ -190,106 +438,176 @@ class Cell:
         self.desc['desc'][key] = data
 
     def get_dlw_data(self):
-        dlw_data = self.dlw_data.copy()
-        for sub_cell in self.cells:
-            cell, origin = sub_cell['cell'], sub_cell['origin']
-            for dlw_type, dlw_type_data in cell.get_dlw_data().items():
-                for dlw_id, data in dlw_type_data.items():
-                    data = data.copy()
-                    if sub_cell['angle'] is not None:
-                        c, s = np.cos(sub_cell['angle']), np.sin(sub_cell['angle'])
-                        data['origin'] = np.array([[c, -s], [s, c]]).dot(data['origin'])
-                        data['angle'] += sub_cell['angle']
-                    data['origin'] = (np.array(origin) + data['origin']).tolist()
-                    if dlw_type not in dlw_data:
-                        dlw_data[dlw_type] = {}
-                    dlw_data[dlw_type][cell.name + '.' + dlw_id] = data
+        # The result is cached until geometries, cells or DLW data are added, callers get their own copy of the entries
+        version = self.get_version()
+        if self._dlw_data is None or self._dlw_data[0] != version:
+            self._dlw_data = (version, self._collect_dlw_data())
+        return copy.deepcopy(self._dlw_data[1])
+
+    def _collect_dlw_data(self):
+        dlw_data = {dlw_type: dict(dlw_type_data) for dlw_type, dlw_type_data in self.dlw_data.items()}
+
+        # Sub-trees without DLW data are skipped, whether a sub-tree contains DLW data is determined once per cell
+        contains_dlw_data = {}
+
+        def has_dlw_data(cell):
+            if id(cell) not in contains_dlw_data:
+                contains_dlw_data[id(cell)] = any(cell.dlw_data.values()) or any(
+                    has_dlw_data(sub_cell['cell']) for sub_cell in cell.cells)
+            return contains_dlw_data[id(cell)]
+
+        # Depth-first walk through the sub-cells, keeping the prefix of the ids and the transformation of the parent
+        stack = [(sub_cell, '', (0., 0.), None) for sub_cell in reversed(self.cells)
+                 if has_dlw_data(sub_cell['cell'])]
+        while stack:
+            sub_cell, prefix, offset, angle = stack.pop()
+            cell, prefix = sub_cell['cell'], prefix + sub_cell['cell'].name + '.'
+            x, y = sub_cell['origin']
+            if angle is not None:
+                c, s = math.cos(angle), math.sin(angle)
+                x, y = c * x - s * y, s * x + c * y
+            offset = (offset[0] + x, offset[1] + y)
+            if sub_cell['angle'] is not None:
+                angle = (angle or 0) + sub_cell['angle']
+
+            # The origins of all entries of the cell are transformed at once
+            entries = [(dlw_type, dlw_id, data) for dlw_type, dlw_type_data in cell.dlw_data.items()
+                       for dlw_id, data in dlw_type_data.items()]
+            if entries:
+                origins = rotate_points([data['origin'] for _, _, data in entries], angle or 0, offset)
+                for (dlw_type, dlw_id, data), origin in zip(entries, origins.tolist()):
+                    data = dict(data, origin=origin)
+                    if angle is not None:
+                        data['angle'] += angle
+                    dlw_data.setdefault(dlw_type, {})[prefix + dlw_id] = data
+
+            stack.extend((child, prefix, offset, angle) for child in reversed(cell.cells)
+                         if has_dlw_data(child['cell']))
 
         return dlw_data
 
     def get_desc(self):
         desc = self.desc.copy()
-        desc['cells'] = {cell['cell'].name: dict(offset=tuple(cell['origin']), angle=cell['angle'] or 0,
-                                                 **cell['cell'].get_desc()) for cell in self.cells}
+        stack = [(self, desc)]
+        while stack:
+            cell, cell_desc = stack.pop()
+            cell_desc['cells'] = {}
+            for sub_cell in cell.cells:
+                sub_cell_desc = dict(offset=tuple(sub_cell['origin']), angle=sub_cell['angle'] or 0,
+                                     **sub_cell['cell'].desc)
+                cell_desc['cells'][sub_cell['cell'].name] = sub_cell_desc
+                stack.append((sub_cell['cell'], sub_cell_desc))
         return desc
 
-    def get_fractured_layer_dict(self, max_points=4000, max_line_points=4000):
-        from gdshelpers.geometry.shapely_adapter import shapely_collection_to_basic_objs, fracture_intelligently
-        fractured_layer_dict = {}
-        for layer, geometries in self.layer_dict.items():
-            fractured_geometries = []
-            for geometry in geometries:
-                geometry = geometry.get_shapely_object() if hasattr(geometry, 'get_shapely_object') else geometry
-                if type(geometry) in [list, tuple]:
-                    geometry = geometric_union(geometry)
-                geometry = shapely_collection_to_basic_objs(geometry)
-                geometry = itertools.chain(
-                    *[fracture_intelligently(geo, max_points, max_line_points) for geo in geometry if not geo.is_empty])
-                fractured_geometries.append(geometry)
-            fractured_layer_dict[layer] = itertools.chain(*fractured_geometries)
-        return fractured_layer_dict
-
-    def get_gdspy_cell(self, executor=None):
+    def get_fractured_layer_dict(self, max_points=4000, max_line_points=4000, executor=None, lazy=False):
+        """
+        Returns a dict mapping the layers to the geometries of this cell, fractured to the given number of points.
+
+        :param max_points: maximum number of points for a polygon
+        :param max_line_points: maximum number of points for a line
+        :param executor: If given, the layers are fractured in parallel using this executor,
+            which can be a thread or a process pool
+        :param lazy: If True and no executor is given, the layers are mapped to iterators, which fracture the
+            geometries while iterating. This way, the fractured geometries can be written to a file without keeping
+            all of them in memory. The iterators can only be consumed once and can't be pickled.
+        """
+        if lazy and not executor:
+            return {layer: _iter_fractured_layer(geometries, max_points, max_line_points)
+                    for layer, geometries in self.layer_dict.items()}
+        if executor:
+            futures = {layer: executor.submit(_fracture_layer, geometries, max_points, max_line_points)
+                       for layer, geometries in self.layer_dict.items()}
+            return {layer: future.result() for layer, future in futures.items()}
+        return {layer: _fracture_layer(geometries, max_points, max_line_points)
+                for layer, geometries in self.layer_dict.items()}
+
+    def get_gdspy_cell(self, executor=None, _convert_cache=None):
         import gdspy
+        convert_cache = {} if _convert_cache is None else _convert_cache
         if self.cell_gdspy is None:
             self.cell_gdspy = gdspy.Cell(self.name)
             for sub_cell in self.cells:
                 angle = np.rad2deg(sub_cell['angle']) if sub_cell['angle'] is not None else None
                 if sub_cell['columns'] == 1 and sub_cell['rows'] == 1 and not sub_cell['spacing']:
                     self.cell_gdspy.add(
-                        gdspy.CellReference(sub_cell['cell'].get_gdspy_cell(executor), origin=sub_cell['origin'],
-                                            rotation=angle, magnification=sub_cell['magnification'],
+                        gdspy.CellReference(sub_cell['cell'].get_gdspy_cell(executor, convert_cache),
+                                            origin=sub_cell['origin'], rotation=angle,
+                                            magnification=sub_cell['magnification'],
                                             x_reflection=sub_cell['x_reflection']))
                 else:
                     self.cell_gdspy.add(
-                        gdspy.CellArray(sub_cell['cell'].get_gdspy_cell(executor), origin=sub_cell['origin'],
-                                        rotation=angle, magnification=sub_cell['magnification'],
+                        gdspy.CellArray(sub_cell['cell'].get_gdspy_cell(executor, convert_cache),
+                                        origin=sub_cell['origin'], rotation=angle,
+                                        magnification=sub_cell['magnification'],
                                         x_reflection=sub_cell['x_reflection'], columns=sub_cell['columns'],
                                         rows=sub_cell['rows'], spacing=sub_cell['spacing']))
             for layer, geometries in self.layer_dict.items():
-                for geometry in geometries:
+                for result, index in _convert_layer(convert_cache, executor, geometries, layer, library='gdspy'):
                     if executor:
-                        executor.submit(convert_to_layout_objs, geometry, layer, library='gdspy') \
-                            .add_done_callback(lambda future: self.cell_gdspy.add(future.result()))
+                        result.add_done_callback(lambda future, i=index: self.cell_gdspy.add(future.result()[i]))
                     else:
-                        self.cell_gdspy.add(convert_to_layout_objs(geometry, layer, library='gdspy'))
+                        self.cell_gdspy.add(result[index])
         return self.cell_gdspy
 
-    def get_oasis_cells(self, grid_steps_per_micron=1000, executor=None):
+    def _get_oasis_cell(self, grid_steps_per_micron, executor, convert_cache, pending):
         import fatamorgana
         import fatamorgana.records
         if self.cell_oasis is None:
             self.cell_oasis = fatamorgana.Cell(fatamorgana.NString(self.name))
-            for sub_cell in self.cells:
-                x, y = sub_cell['origin']
-                x, y = round(x * grid_steps_per_micron), round(y * grid_steps_per_micron)
-                angle = np.rad2deg(sub_cell['angle']) if sub_cell['angle'] is not None else None
+            # The placements of all sub-cells are converted to grid steps and degrees at once
+            origins = np.rint(np.array([sub_cell['origin'] for sub_cell in self.cells], dtype=float).reshape(-1, 2)
+                              * grid_steps_per_micron).astype(np.int64).tolist()
+            spacings = [(0, 0) if sub_cell['spacing'] is None else sub_cell['spacing'] for sub_cell in self.cells]
+            spacings = np.rint(np.array(spacings, dtype=float).reshape(-1, 2)
+                               * grid_steps_per_micron).astype(np.int64).tolist()
+            angles = np.rad2deg([sub_cell['angle'] or 0 for sub_cell in self.cells]).tolist()
+            for sub_cell, (x, y), spacing, angle in zip(self.cells, origins, spacings, angles):
                 repetition = None
                 if not (sub_cell['columns'] == 1 and sub_cell['rows'] == 1 and not sub_cell['spacing']):
-                    repetition = fatamorgana.basic.GridRepetition(
-                        [round(sub_cell['spacing'][0] * grid_steps_per_micron), 0],
-                        sub_cell['columns'],
-                        [0, round(sub_cell['spacing'][1] * grid_steps_per_micron)],
-                        sub_cell['rows'])
+                    repetition = fatamorgana.basic.GridRepetition([spacing[0], 0], sub_cell['columns'],
+                                                                  [0, spacing[1]], sub_cell['rows'])
                 self.cell_oasis.placements.append(
                     fatamorgana.records.Placement(False, name=fatamorgana.NString(sub_cell['cell'].name), x=x, y=y,
-                                                  angle=angle, repetition=repetition))
+                                                  angle=angle if sub_cell['angle'] is not None else None,
+                                                  repetition=repetition))
             for layer, geometries in self.layer_dict.items():
-                for geometry in geometries:
+                results = _convert_layer(convert_cache, executor, geometries,
+                                         (layer if isinstance(layer, int) else layer[0]),
+                                         datatype=(None if isinstance(layer, int) else layer[1]), library='oasis',
+                                         grid_steps_per_micron=grid_steps_per_micron, max_points=np.inf,
+                                         max_points_line=np.inf)
+                for result, index in results:
+                    # Records are modified while writing, so each occurrence needs its own copy of the records
                     if executor:
-                        executor.submit(convert_to_layout_objs, geometry,
-                                        (layer if isinstance(layer, int) else layer[0]),
-                                        datatype=(None if isinstance(layer, int) else layer[1]), library='oasis',
-                                        grid_steps_per_micron=grid_steps_per_micron, max_points=np.inf,
-                                        max_points_line=np.inf) \
-                            .add_done_callback(lambda future: self.cell_oasis.geometry.extend(future.result()))
+                        # Collected once all cells have been submitted, so errors of the workers are raised
+                        pending.append((self.cell_oasis, result, index))
                     else:
-                        self.cell_oasis.geometry.extend(
-                            convert_to_layout_objs(geometry, layer, library='oasis',
-                                                   grid_steps_per_micron=grid_steps_per_micron,
-                                                   max_points=np.inf, max_points_line=np.inf))
-        return [self.cell_oasis] + [oasis_cell for sub_cell in self.cells for oasis_cell in
-                                    sub_cell['cell'].get_oasis_cells(grid_steps_per_micron, executor)]
+                        self.cell_oasis.geometry.extend(map(copy.copy, result[index]))
+        return self.cell_oasis
+
+    def get_oasis_cells(self, grid_steps_per_micron=1000, executor=None, _convert_cache=None):
+        """
+        Returns the fatamorgana cells of this cell and all its sub-cells.
+        Each cell is contained only once, even if it is referenced several times.
+
+        :param grid_steps_per_micron: Defines the resolution
+        :param executor: If given, the geometries are converted in parallel using this executor
+        """
+        convert_cache = {} if _convert_cache is None else _convert_cache
+        oasis_cells = []
+        pending = []
+        visited = set()
+        stack = [self]
+        while stack:
+            cell = stack.pop()
+            if id(cell) in visited:
+                continue
+            visited.add(id(cell))
+            oasis_cells.append(cell._get_oasis_cell(grid_steps_per_micron, executor, convert_cache, pending))
+            stack.extend(sub_cell['cell'] for sub_cell in reversed(cell.cells))
+        for oasis_cell, future, index in pending:
+            oasis_cell.geometry.extend(map(copy.copy, future.result()[index]))
+        return oasis_cells
 
     def get_gdspy_lib(self):
         import gdspy
@@ -349,20 +667,20 @@ class Cell:
             import gdspy
 
             if parallel:
-                from concurrent.futures import ProcessPoolExecutor
-                with ProcessPoolExecutor(max_workers=max_workers) as pool:
+                with _process_pool(max_workers, 'gdspy') as pool:
                     self.get_gdspy_cell(pool)
             else:
                 self.get_gdspy_cell()
 
             self.get_gdspy_lib().precision = self.get_gdspy_lib().unit / grid_steps_per_micron
-            gdspy_cells = self.get_gdspy_lib().cell_dict.values()
+            gdspy_cells = list(self.get_gdspy_lib().cell_dict.values())
             if parallel:
-                from concurrent.futures import ProcessPoolExecutor
-                with ProcessPoolExecutor(max_workers=max_workers) as pool:
-                    binary_cells = pool.map(gdspy.Cell.to_gds, gdspy_cells, [grid_steps_per_micron] * len(gdspy_cells))
+                chunksize = max(1, len(gdspy_cells) // (4 * (max_workers or os.cpu_count() or 1)))
+                with _process_pool(max_workers, 'gdspy') as pool:
+                    binary_cells = pool.map(gdspy.Cell.to_gds, gdspy_cells, itertools.repeat(grid_steps_per_micron),
+                                            chunksize=chunksize)
             else:
-                binary_cells = map(gdspy.Cell.to_gds, gdspy_cells, [grid_steps_per_micron] * len(gdspy_cells))
+                binary_cells = map(gdspy.Cell.to_gds, gdspy_cells, itertools.repeat(grid_steps_per_micron))
 
             self.get_gdspy_lib().write_gds(name + '.gds', cells=[], binary_cells=binary_cells)
         elif library == 'fatamorgana':
@@ -370,112 +688,180 @@ class Cell:
             layout = fatamorgana.OasisLayout(grid_steps_per_micron)
 
             if parallel:
-                from concurrent.futures import ProcessPoolExecutor
-                with ProcessPoolExecutor(max_workers=max_workers) as pool:
+                with _process_pool(max_workers, 'fatamorgana.records') as pool:
                     cells = self.get_oasis_cells(grid_steps_per_micron, pool)
             else:
                 cells = self.get_oasis_cells(grid_steps_per_micron)
 
-            layout.cells = [cells[0]] + list(set(cells[1:]))
+            # Different cells might have the same name, keep the first cell of each name
+            unique_cells = {}
+            for cell in cells:
+                unique_cells.setdefault(cell.name.string, cell)
+            layout.cells = list(unique_cells.values())
+
+            if parallel:
+                # The modal variables are reset at the start of each cell, so the cells can be serialized separately
+                chunksize = max(1, len(layout.cells) // (4 * (max_workers or os.cpu_count() or 1)))
+                with _process_pool(max_workers, 'fatamorgana.records') as pool:
+                    layout.cells = [_SerializedOasisCell(data) for data in
+                                    pool.map(_serialize_oasis_cell, layout.cells, chunksize=chunksize)]
 
             with open(name + '.oas', 'wb') as f:
                 layout.write(f)
         elif library == 'ezdxf':
             from gdshelpers.export.dxf_export import write_cell_to_dxf_file
             with open(name + '.dxf', 'w') as f:
-                write_cell_to_dxf_file(f, self, grid_steps_per_micron, parallel=parallel)
+                write_cell_to_dxf_file(f, self, grid_steps_per_micron, parallel=parallel, max_workers=max_workers)
         else:
             raise ValueError('library must be either "gdshelpers", "gdspy", "fatamorgana" or "ezdxf"')
 
         dlw_data = self.get_dlw_data()
         if dlw_data:
-            with open(name + '.dlw', 'w') as f:
-                json.dump(dlw_data, f, indent=True)
+            with open(name + '.dlw', 'w', encoding='utf-8') as f:
+                _dump_json(dlw_data, f)
 
-    def save_desc(self, filename: str):
+    def save_desc(self, filename: str, indent=None):
         """
         Saves a description file for the layout. The file format is not final yet and might change in a future release.
 
         :param filename: name of the file the description data will be written to
+        :param indent: Indentation of the written JSON, e.g. for debugging. If None, the file is written compactly.
         """
         if not filename.endswith('.desc'):
             filename += '.desc'
-        with open(filename, 'w') as f:
-            json.dump(self.get_desc(), f, indent=True)
+        with open(filename, 'w', encoding='utf-8') as f:
+            _dump_json(self.get_desc(), f, indent)
 
     def get_reduced_layer(self, layer: int):
         """
         Returns a single shapely object containing the structures on a certain layer from this cell and all added cells.
+        If the layer only contains shapely geometries, the result is cached until geometries or cells are added to
+        this cell or one of its sub-cells. Parts like waveguides can still be modified after they have been added,
+        so layers containing parts are recalculated on every call.
 
         :param layer: the layer whose structures will be returned
         :return: a single shapely-geometry
         """
+        if self._layer_has_parts(layer):
+            return geometric_union(list(self._collect_layer(layer)))
 
-        def translate_and_rotate(geometry, offset, angle, columns, rows, spacing):
-            if not geometry:
-                return geometry
+        version = self.get_version()
+        cached = self._reduced_layers.get(layer)
+        if cached is not None and cached[0] == version:
+            return cached[1]
 
-            if not spacing:
-                return translate(rotate(geometry, angle if angle else 0, use_radians=True, origin=(0, 0)), *offset)
+        # The hierarchy is flattened first, so the union of all geometries is calculated only once
+        reduced_layer = geometric_union(list(self._collect_layer(layer)))
+        self._reduced_layers[layer] = (version, reduced_layer)
+        return reduced_layer
 
-            return translate(
-                geometric_union(
-                    translate(rotate(geometry, angle if angle else 0, use_radians=True, origin=(0, 0)), spacing[0] * c,
-                              spacing[1] * r) for c in range(columns) for r in range(rows)), *offset)
+    def _layer_has_parts(self, layer: int):
+        """
+        Returns whether the layer of this cell or any of its sub-cells contains parts and not only shapely geometries.
+        """
+        return layer in self._get_part_layers()
 
-        return geometric_union(
-            (self.layer_dict[layer] if layer in self.layer_dict else []) +
-            [translate_and_rotate(cell['cell'].get_reduced_layer(layer), cell['origin'], cell['angle'], cell['columns'],
-                                  cell['rows'], cell['spacing'])
-             for cell in self.cells])
+    def _get_part_layers(self):
+        """
+        Returns the layers of this cell and all its sub-cells which contain parts as frozenset.
+        The result is cached until geometries or cells are added to this cell or one of its sub-cells.
+        """
+        version = self.get_version()
+        if self._rolled_up_part_layers is None or self._rolled_up_part_layers[0] != version:
+            part_layers = set(self._part_layers)
+            for sub_cell in self.cells:
+                part_layers.update(sub_cell['cell']._get_part_layers())
+            self._rolled_up_part_layers = (version, frozenset(part_layers))
+        return self._rolled_up_part_layers[1]
+
+    def _collect_layer(self, layer: int):
+        """
+        Yields the shapely geometries on a certain layer of this cell and all added cells without merging them.
+        The geometries of the sub-cells are transformed to the coordinates of this cell, the transformations of all
+        levels are combined, so each geometry is transformed only once.
 
-    def export_mesh(self, filename: str, layer_defs):
+        :param layer: the layer whose structures will be returned
+        """
+        # Cells to visit together with their transformation as 3x3 matrix, None if they aren't transformed
+        stack = [(self, None)]
+        while stack:
+            cell, matrix = stack.pop()
+            for geometry in cell.layer_dict.get(layer, []):
+                geometry = geometry.get_shapely_object() if hasattr(geometry, 'get_shapely_object') else geometry
+                if matrix is not None:
+                    geometry = affine_transform(geometry, (matrix[0, 0], matrix[0, 1], matrix[1, 0], matrix[1, 1],
+                                                           matrix[0, 2], matrix[1, 2]))
+                yield geometry
+
+            for sub_cell in cell.cells:
+                # cos and sin are rounded like shapely's rotate does, so right angles result in exact coordinates
+                cos, sin = math.cos(sub_cell['angle'] or 0), math.sin(sub_cell['angle'] or 0)
+                cos, sin = (0. if abs(cos) < 2.5e-16 else cos), (0. if abs(sin) < 2.5e-16 else sin)
+                copies = itertools.product(range(sub_cell['columns']), range(sub_cell['rows'])) \
+                    if sub_cell['spacing'] else [(0, 0)]
+                for column, row in copies:
+                    x, y = sub_cell['origin']
+                    if sub_cell['spacing']:
+                        x, y = x + sub_cell['spacing'][0] * column, y + sub_cell['spacing'][1] * row
+                    sub_matrix = np.array([[cos, -sin, x], [sin, cos, y], [0, 0, 1]])
+                    stack.append((sub_cell['cell'], sub_matrix if matrix is None else matrix.dot(sub_matrix)))
+
+    def export_mesh(self, filename: str, layer_defs, parallel=False, max_workers=None):
         """
         Saves the current geometry as a mesh-file.
 
         :param filename: Name of the file which will be created. The file ending determines the format.
         :param layer_defs: Definition of the layers, should be a list like [(layer,(z_min,z_max)),...]
+        :param parallel: Defines if the layers are reduced in parallel processes.
+        :param max_workers: If parallel is True, this can be used to limit the number of parallel processes.
         """
-        from functools import reduce
         from trimesh.primitives import Extrusion
+        from trimesh.util import concatenate
         from trimesh.transformations import translation_matrix
 
-        reduce(lambda a, b: a + b, (Extrusion(polygon=geometry, height=min_max[1] - min_max[0],
-                                              transform=translation_matrix((0, 0, min_max[0])))
-                                    for layer, min_max in layer_defs.items()
-                                    for geometry in (lambda x: x if hasattr(x, '__iter__') else [x, ])(
-            self.get_reduced_layer(layer)))).export(filename)
+        if parallel:
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(max_workers=max_workers) as pool:
+                futures = {layer: pool.submit(self.get_reduced_layer, layer) for layer in layer_defs}
+                reduced_layers = {layer: future.result() for layer, future in futures.items()}
+            version = self.get_version()
+            self._reduced_layers.update((layer, (version, geometry)) for layer, geometry in reduced_layers.items())
+        else:
+            reduced_layers = {layer: self.get_reduced_layer(layer) for layer in layer_defs}
 
-    def get_patches(self, origin=(0, 0), angle_sum=0, angle=0, layers: Optional[List[int]] = None):
-        from descartes import PolygonPatch
+        # Concatenate all meshes at once, adding them one by one copies the growing mesh for each of them
+        concatenate([Extrusion(polygon=polygon, height=min_max[1] - min_max[0],
+                               transform=translation_matrix((0, 0, min_max[0])))
+                     for layer, min_max in layer_defs.items()
+                     for polygon in getattr(reduced_layers[layer], 'geoms', [reduced_layers[layer]])]).export(filename)
 
-        def rotate_pos(pos, rotation_angle):
-            if rotation_angle is None:
-                return pos
-            c, s = np.cos(rotation_angle), np.sin(rotation_angle)
-            result = np.array([[c, -s], [s, c]]).dot(pos)
-            return result
+    def get_patches(self, origin=(0, 0), angle_sum=0, angle=0, layers: Optional[List[int]] = None):
+        from matplotlib.patches import PathPatch
 
         own_patches = []
         for layer, geometry in self.layer_dict.items():
             if layers is not None and layer not in layers:
                 continue
-            geometry = geometric_union(geometry)
-            if geometry.is_empty:
+            path = _polygons_to_path(geometry, origin, angle_sum)
+            if path is None:
                 continue
-            geometry = translate(rotate(geometry, angle_sum, use_radians=True, origin=(0, 0)), *origin)
             own_patches.append(
-                PolygonPatch(geometry, color=['red', 'green', 'blue', 'teal', 'pink'][(np.sum(layer) - 1) % 5],
-                             linewidth=0))
+                PathPatch(path, color=['red', 'green', 'blue', 'teal', 'pink'][(np.sum(layer) - 1) % 5], linewidth=0))
 
-        sub_cells_patches = [p for cell_dict in self.cells for p in
+        # The origins of all sub-cells are rotated by the total rotation of this cell at once
+        positions = rotate_points([cell_dict['origin'] for cell_dict in self.cells], angle_sum, origin)
+        sub_cells_patches = [p for cell_dict, position in zip(self.cells, positions) for p in
                              cell_dict['cell'].get_patches(
-                                 np.array(origin) + rotate_pos(cell_dict['origin'], angle),
-                                 angle_sum=angle_sum + (cell_dict['angle'] or 0), angle=cell_dict['angle'],
+                                 position, angle_sum=angle_sum + (cell_dict['angle'] or 0), angle=cell_dict['angle'],
                                  layers=layers)]
 
         return own_patches + sub_cells_patches
 
+    def _get_patch_collection(self, layers: Optional[List[int]] = None, **kwargs):
+        # All patches are drawn by a single artist instead of one artist per patch
+        from matplotlib.collections import PatchCollection
+        return PatchCollection(self.get_patches(layers=layers), match_original=True, **kwargs)
+
     def save_image(self, filename: str, layers: Optional[List[int]] = None, antialiased=True, resolution=1.,
                    ylim=(None, None), xlim=(None, None), scale=1.):
         """
@@ -498,9 +884,7 @@ class Cell:
         scale *= 5 / 127. if is_vector else 1.
 
         fig, ax = plt.subplots()
-        for patch in self.get_patches(layers=layers):
-            patch.set_antialiased(antialiased)
-            ax.add_patch(patch)
+        ax.add_collection(self._get_patch_collection(layers=layers, antialiased=antialiased))
 
         # Autoscale, then change the axis limits and read back what is actually displayed
         ax.autoscale(True, tight=True)
@@ -526,8 +910,7 @@ class Cell:
         import matplotlib.pyplot as plt
 
         fig, ax = plt.subplots()
-        for patch in self.get_patches(layers=layers):
-            ax.add_patch(patch)
+        ax.add_collection(self._get_patch_collection(layers=layers))
 
         bounds = self.get_bounds(layers)
         ax.set_xlim(bounds[0] - padding, bounds[2] + padding)
@@ -544,13 +927,21 @@ class Cell:
         :param origin: Position of the marker
         :param box_size: Size of the box of the marker
         """
+        self._add_dlw_markers([label], layer, [origin], box_size)
+
+    def _add_dlw_markers(self, labels, layer: int, origins, box_size):
+        """
+        Adds multiple markers for 3D hybrid integration, adding all markers and all labels to their layers at once.
+        """
         from gdshelpers.parts.marker import DLWMarker
         from gdshelpers.parts.text import Text
 
-        self.add_to_layer(layer, DLWMarker(origin, box_size=box_size))
-        self.add_to_layer(std_layers.parnamelayer1, Text(origin, 2, label, alignment='center-center'))
+        self.add_to_layer(layer, *[DLWMarker(origin, box_size=box_size) for origin in origins])
+        self.add_to_layer(std_layers.parnamelayer1, *[Text(origin, 2, label, alignment='center-center')
+                                                      for label, origin in zip(labels, origins)])
 
-        self.add_dlw_data('marker', label, {'origin': list(origin), 'angle': 0})
+        for label, origin in zip(labels, origins):
+            self.add_dlw_data('marker', label, {'origin': list(origin), 'angle': 0})
 
     def add_dlw_taper_at_port(self, label: str, layer: int, port: Port, taper_length: float, tip_width=.01,
                               with_markers=True, box_size=2.5):
@@ -580,9 +971,13 @@ class Cell:
         self.add_dlw_data('taper', str(label), {'origin': taper_port.origin.tolist(), 'angle': port.angle,
                                                 'starting_width': port.width, 'taper_length': taper_length})
         if with_markers:
-            for i, (v, l) in enumerate(itertools.product((-20, 20), (taper_length, 0))):
-                self.add_dlw_marker(str(label) + '-' + str(i), layer,
-                                    port.parallel_offset(v).longitudinal_offset(l).origin, box_size=box_size)
+            # Same arithmetic as port.parallel_offset(v).longitudinal_offset(l) for all four markers at once,
+            # the offset port normalizes its angle again, which is reproduced by copying the port
+            angle, offset_angle = port.angle, port.copy().angle
+            parallel = np.array([np.cos(angle + np.pi / 2), np.sin(angle + np.pi / 2)]) * np.array([[-20], [20]])
+            longitudinal = np.array([np.cos(offset_angle), np.sin(offset_angle)]) * np.array([[taper_length], [0]])
+            origins = ((port.origin + parallel)[:, None] + longitudinal[None]).reshape(-1, 2)
+            self._add_dlw_markers([str(label) + '-' + str(i) for i in range(len(origins))], layer, origins, box_size)
 
 
 if __name__ == '__main__':
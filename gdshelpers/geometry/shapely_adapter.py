@@ -1,5 +1,6 @@
 import warnings
 import itertools
+import math
 
 import numpy as np
 import shapely.topology
@@ -7,10 +8,16 @@ import shapely.ops
 import shapely.geometry
 import shapely.geos
 import shapely.validation
+from shapely.strtree import STRtree
 
 import gdshelpers
 from gdshelpers.helpers import raith_eline_dosefactor_to_datatype
 
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
 
 def shapely_collection_to_basic_objs(collection):
     """
@@ -72,17 +79,15 @@ def cut_shapely_object(obj, x_axis=None, y_axis=None, other_side=False):
             x_axis = None
             y_axis = cut_center[1]
 
-    if x_axis is not None:
-        cut_boxes = [shapely.geometry.box(bbox[0][0], bbox[0][1], x_axis, bbox[1][1]),
-                     shapely.geometry.box(x_axis, bbox[0][1], bbox[1][0], bbox[1][1])]
-    else:
-        cut_boxes = [shapely.geometry.box(bbox[0][0], bbox[0][1], bbox[1][0], y_axis),
-                     shapely.geometry.box(bbox[0][0], y_axis, bbox[1][0], bbox[1][1])]
+    # Both boxes span the whole bounding box, except along the cut axis, where they end or start at the cut
+    axis, cut = (0, x_axis) if x_axis is not None else (1, y_axis)
+    cut_bounds = np.tile(bbox.ravel(), (2, 1))
+    cut_bounds[0, 2 + axis] = cut_bounds[1, axis] = cut
 
     try:
+        cut_polygons = [obj.intersection(shapely.geometry.box(*bounds)) for bounds in cut_bounds]
         out_polygons = list()
-        for cut_box in cut_boxes:
-            cut_polygon = obj.intersection(cut_box)
+        for cut_polygon in cut_polygons:
             out_polygons.extend(hasattr(cut_polygon, 'geoms') and list(cut_polygon.geoms) or [cut_polygon, ])
     except shapely.geos.TopologicalError:
         # In case of invalid geometries, try to fix them and refracture
@@ -98,27 +103,74 @@ def cut_shapely_object(obj, x_axis=None, y_axis=None, other_side=False):
     return out_polygons
 
 
-def _number_of_points(poly):
+def _cut_into_strips(polygon, n_strips):
+    """
+    Cut a polygon without holes into up to *n_strips* strips along the longer side of its bounding box.
+
+    The strips are placed such that each of them contains about the same number of vertices of the polygon.
+    If the polygon winds through the strips more than once, like a spiral, cutting it into strips would create
+    many more pieces than halving it repeatedly. In this case, None is returned.
+
+    :param polygon: Shapely polygon without interiors
+    :param n_strips: Number of strips
+    :return: List of the polygons within the strips or None, if any strip contains more than one polygon.
+    :rtype: list, None
+    """
+    _safety_overlap = 1.
+    bbox = np.array(polygon.bounds).reshape(2, -1)
+    bbox += ((-_safety_overlap, -_safety_overlap),
+             (_safety_overlap, _safety_overlap))
+    axis = (bbox[1] - bbox[0]).argmax()
+
+    coords = np.asarray(polygon.exterior.coords)[:-1, axis]
+    cuts = np.unique(np.quantile(coords, np.linspace(0, 1, n_strips + 1)[1:-1]))
+    edges = np.concatenate(([bbox[0, axis]], cuts, [bbox[1, axis]]))
+    strip_bounds = np.tile(bbox.ravel(), (len(edges) - 1, 1))
+    strip_bounds[:, axis], strip_bounds[:, 2 + axis] = edges[:-1], edges[1:]
+
+    pieces = []
+    for bounds in strip_bounds:
+        # Lines and points on the borders of the strips are dropped
+        strip_pieces = [piece for piece in
+                        shapely_collection_to_basic_objs(polygon.intersection(shapely.geometry.box(*bounds)))
+                        if type(piece) == shapely.geometry.Polygon and not piece.is_empty]
+        if len(strip_pieces) > 1:
+            return None
+        pieces.extend(strip_pieces)
+    return pieces
+
+
+def _number_of_points(poly, cache=None):
     """
     Returns the number of points in a Shapely geometry.
 
     :param poly: Shapely geometry object.
+    :param cache: Optional dict mapping the ids of geometries to the geometries and their number of points. The
+        geometries are kept as well, so their ids can't be reused while they are in the cache.
     :return: Number of points int the Shapely object.
     :rtype: int
     """
-    if hasattr(poly, '_gdsh_n_points'):
-        return poly._gdsh_n_points
-
-    elif hasattr(poly, 'geoms'):
-        poly._gdsh_n_points = sum(_number_of_points(p) for p in poly.geoms)
+    cached = cache.get(id(poly)) if cache is not None else None
+    if cached is not None:
+        return cached[1]
 
+    if hasattr(poly, 'geoms'):
+        n_points = sum(_number_of_points(p, cache) for p in poly.geoms)
     elif type(poly) == shapely.geometry.Polygon:
-        poly._gdsh_n_points = len(poly.exterior.coords) + sum([len(shapely.geometry.LinearRing(x).coords) for x
-                                                               in list(poly.interiors)])
+        n_points = len(poly.exterior.coords) + sum(len(interior.coords) for interior in poly.interiors)
     else:
-        poly._gdsh_n_points = len(poly.coords)
+        n_points = len(poly.coords)
 
-    return poly._gdsh_n_points
+    if cache is not None:
+        cache[id(poly)] = (poly, n_points)
+    return n_points
+
+
+def _numbers_of_points(polys):
+    """
+    Returns an array containing the number of points of each of the given Shapely geometries.
+    """
+    return np.fromiter((_number_of_points(poly) for poly in polys), dtype=np.int64, count=len(polys))
 
 
 def heal(objs, max_points, max_interior=0):
@@ -135,51 +187,71 @@ def heal(objs, max_points, max_interior=0):
     :rtype: list
     """
 
-    segments_joined = True
-    while segments_joined:
-        segments_joined = False
-        for i, polygon in enumerate(objs):
-            if type(polygon) != shapely.geometry.Polygon:
-                continue
+    # Only polygons with overlapping bounding boxes can touch, so the candidates for joining are taken from a tree
+    is_polygon = np.array([type(polygon) == shapely.geometry.Polygon for polygon in objs], dtype=bool)
+    polygon_indices = np.flatnonzero(is_polygon)
+    tree = STRtree([objs[i] for i in polygon_indices])
+    index_by_id = {id(objs[i]): i for i in polygon_indices}
+    # Number of points of each of the objects, counted once for all polygons
+    n_points = np.zeros(len(objs), dtype=np.int64)
+    n_points[polygon_indices] = _numbers_of_points([objs[i] for i in polygon_indices])
+    joined = np.zeros(len(objs), dtype=bool)
+
+    def joinable_candidates(geometry, geometry_points):
+        candidates = np.array([index_by_id[id(candidate)] for candidate in tree.query(geometry)], dtype=np.int64)
+        # Polygons which are already joined or have too many points are filtered out at once
+        candidates = candidates[~joined[candidates]]
+        if max_points:
+            candidates = candidates[geometry_points + n_points[candidates] < (max_points - 2)]
+        return np.sort(candidates).tolist()
+
+    # Each polygon absorbs touching polygons until none of them can be joined anymore
+    healed = []
+    for i, polygon in enumerate(objs):
+        if joined[i]:
+            continue
+        if not is_polygon[i]:
+            healed.append(polygon)
+            continue
+        joined[i] = True
+        polygon_points = int(n_points[i])
+
+        segments_joined = True
+        while segments_joined:
+            segments_joined = False
+            candidates = joinable_candidates(polygon, polygon_points)
+            for j in candidates:
+                polygon2 = objs[j]
+                if polygon == polygon2 or not polygon.touches(polygon2):
+                    continue
 
-            polygon_points = _number_of_points(polygon)
+                joined_poly = polygon.union(polygon2)
 
-            for j, polygon2 in enumerate(objs):
-                if polygon is polygon2 or polygon == polygon2:
-                    continue
-                if type(polygon2) != shapely.geometry.Polygon:
+                if type(joined_poly) != shapely.geometry.Polygon:
                     continue
 
-                if max_points and polygon_points + _number_of_points(polygon2) >= (max_points - 2):
+                if len(joined_poly.interiors) > max_interior:
                     continue
 
-                if polygon.touches(polygon2):
-                    joined_poly = polygon.union(polygon2)
-
-                    if type(joined_poly) != shapely.geometry.Polygon:
-                        continue
-
-                    if len(joined_poly.interiors) > max_interior:
-                        continue
-
-                    if max_points and _number_of_points(joined_poly) >= max_points:
-                        continue
-
-                    objs.append(joined_poly)
-                    segments_joined = True
-                    if i > j:
-                        del objs[i]
-                        del objs[j]
-                    else:
-                        del objs[j]
-                        del objs[i]
+                joined_points = _number_of_points(joined_poly)
+                if max_points and joined_points >= max_points:
+                    continue
 
-                    break
-    return objs
+                polygon, polygon_points = joined_poly, joined_points
+                joined[j] = True
+                # The remaining candidates are tested again against the joined polygon
+                segments_joined = True
+                break
+        healed.append(polygon)
+    return healed
 
 
 def fracture(obj, max_points_poly, max_points_line, max_interior=0):
+    # Number of points of the polygons, only kept during this call
+    n_points_cache = {}
     out_polygons = [obj, ]
+    # Ids of polygons in out_polygons which are halved instead of being cut into strips
+    halved_ids = set()
 
     done_counter = 0
     while done_counter < len(out_polygons):
@@ -194,10 +266,25 @@ def fracture(obj, max_points_poly, max_points_line, max_interior=0):
             extended_shapes = shapely_collection_to_basic_objs(shapes)
             out_polygons.extend(extended_shapes)
 
-        elif max_points and _number_of_points(current_polygon) > max_points > 0:
+        elif max_points and _number_of_points(current_polygon, n_points_cache) > max_points > 0:
             uncut_polygon = out_polygons.pop(done_counter)
-            shapes = cut_shapely_object(uncut_polygon)
-            extended_shapes = shapely_collection_to_basic_objs(shapes)
+            shapes = None
+            if (type(uncut_polygon) == shapely.geometry.Polygon and not uncut_polygon.interiors
+                    and id(uncut_polygon) not in halved_ids):
+                # Cut into as many strips as necessary at once instead of halving repeatedly
+                try:
+                    n_strips = math.ceil(_number_of_points(uncut_polygon, n_points_cache) / max_points)
+                    shapes = _cut_into_strips(uncut_polygon, n_strips)
+                except shapely.geos.TopologicalError:
+                    pass
+            halved_ids.discard(id(uncut_polygon))
+            if not shapes or len(shapes) < 2:
+                shapes = cut_shapely_object(uncut_polygon)
+                extended_shapes = shapely_collection_to_basic_objs(shapes)
+                # The parts of a polygon which couldn't be cut into strips are halved as well
+                halved_ids.update(id(shape) for shape in extended_shapes)
+            else:
+                extended_shapes = shapely_collection_to_basic_objs(shapes)
             out_polygons.extend(extended_shapes)
         else:
             done_counter += 1
@@ -225,6 +312,11 @@ def geometric_union(objs):
     :rtype: shapely.base.BaseGeometry
     """
     objs = [obj.get_shapely_object() if hasattr(obj, 'get_shapely_object') else obj for obj in objs]
+    if not objs:
+        return shapely.geometry.GeometryCollection()
+    # A single polygon can't overlap with anything, collections and lines might still need to be merged or noded
+    if len(objs) == 1 and type(objs[0]) == shapely.geometry.Polygon:
+        return objs[0]
     return shapely.ops.unary_union(objs)
 
 
@@ -343,10 +435,23 @@ def convert_to_layout_objs(objs, layer=1, datatype=None, path_width=1.0, path_pa
     # Convert the object or the collection to a list of basic shapely objects
     objs = shapely_collection_to_basic_objs(objs)
 
-    fractured_objs = itertools.chain(*[fracture_intelligently(obj, max_points=max_points,
-                                                              max_points_line=max_points_line,
-                                                              over_fracture_factor=over_fracture_factor)
-                                       for obj in objs if not obj.is_empty])
+    fractured_objs = list(itertools.chain(*[fracture_intelligently(obj, max_points=max_points,
+                                                                   max_points_line=max_points_line,
+                                                                   over_fracture_factor=over_fracture_factor)
+                                            for obj in objs if not obj.is_empty]))
+
+    if library == 'oasis':
+        # The coordinates of all objects are rounded at once, each record gets its start point and deltas
+        converted_objs = [obj for obj in fractured_objs if type(obj) == shapely.geometry.Polygon
+                          or (type(obj) == shapely.geometry.LineString and path_width)]
+        coords_list = [np.asarray((obj.exterior if type(obj) == shapely.geometry.Polygon else obj).coords)
+                       for obj in converted_objs]
+        offsets = np.cumsum([0] + [len(coords) for coords in coords_list]).tolist()
+        rounded_coords = (np.multiply(np.concatenate(coords_list), grid_steps_per_micron).astype(np.int64)
+                          if coords_list else np.empty((0, 2), dtype=np.int64))
+        starts, deltas = rounded_coords.tolist(), np.diff(rounded_coords, axis=0).tolist()
+        oasis_coords = {id(obj): (starts[start], deltas[start:end - 1])
+                        for obj, start, end in zip(converted_objs, offsets[:-1], offsets[1:])}
 
     exports_objs = list()
     for obj in fractured_objs:
@@ -362,12 +467,12 @@ def convert_to_layout_objs(objs, layer=1, datatype=None, path_width=1.0, path_pa
                     exports_objs.append(gdspy.PolyPath(obj.coords, layer=layer, datatype=datatype, width=path_width,
                                                        ends=path_pathtype))
                 elif library == 'oasis':
-                    rounded_coords = np.multiply(obj.coords, grid_steps_per_micron).astype(np.int)
+                    (x, y), point_list = oasis_coords[id(obj)]
                     exports_objs.append(
-                        fatamorgana.records.Path((rounded_coords[1:] - rounded_coords[:-1]).tolist(), layer=layer,
+                        fatamorgana.records.Path(point_list, layer=layer,
                                                  datatype=datatype, half_width=int(path_width * grid_steps_per_micron),
                                                  extension_start=path_pathtype, extension_end=path_pathtype,
-                                                 x=rounded_coords[0][0], y=rounded_coords[0][1]))
+                                                 x=x, y=y))
 
         elif type(obj) == shapely.geometry.Polygon:
             assert len(obj.interiors) <= 1, 'No polygons with more than one hole allowed, got %i' % len(obj.interiors)
@@ -376,17 +481,35 @@ def convert_to_layout_objs(objs, layer=1, datatype=None, path_width=1.0, path_pa
             elif library == 'gdspy':
                 exports_objs.append(gdspy.Polygon(obj.exterior.coords, layer=layer, datatype=datatype))
             elif library == 'oasis':
-                rounded_coords = np.multiply(obj.exterior.coords, grid_steps_per_micron).astype(np.int)
+                (x, y), point_list = oasis_coords[id(obj)]
                 exports_objs.append(
-                    fatamorgana.records.Polygon((rounded_coords[1:] - rounded_coords[:-1]).tolist(),
-                                                layer=layer, datatype=datatype, x=rounded_coords[0][0],
-                                                y=rounded_coords[0][1]))
+                    fatamorgana.records.Polygon(point_list, layer=layer, datatype=datatype, x=x, y=y))
 
         else:
             raise TypeError('Unhandled type "%s"' % type(obj))
     return exports_objs
 
 
+def convert_to_layout_objs_batch(objs_list, layer=1, datatype=None, path_width=1.0, path_pathtype=0, max_points=None,
+                                 over_fracture_factor=1, max_points_line=None, library='gdscad',
+                                 grid_steps_per_micron=1000):
+    """
+    Convert each entry of *objs_list* separately like :func:`convert_to_layout_objs` does, but within one call.
+
+    In contrast to passing a list to :func:`convert_to_layout_objs`, the entries are not merged. Converting a whole
+    batch in one call is much cheaper if the conversion is sent to another process, as e.g. thousands of small
+    rectangles would otherwise need thousands of round trips.
+
+    The remaining parameters are the same as for :func:`convert_to_layout_objs`.
+
+    :param objs_list: List of Parts and/or Shapely objects.
+    :return: List containing the list of converted objects for each entry of *objs_list*.
+    :rtype: list
+    """
+    return [convert_to_layout_objs(objs, layer, datatype, path_width, path_pathtype, max_points, over_fracture_factor,
+                                   max_points_line, library, grid_steps_per_micron) for objs in objs_list]
+
+
 def bounds_union(bound_list):
     """
     Calculates the bounding box of all bounding boxes in the given list.
@@ -394,9 +517,10 @@ def bounds_union(bound_list):
 
     :param bound_list: List of tuples containing all bounding boxes to be merged
     """
-    bounds_array = np.array(bound_list)
-    return (np.min(bounds_array[:, 0]), np.min(bounds_array[:, 1]),
-            np.max(bounds_array[:, 2]), np.max(bounds_array[:, 3]))
+    bounds_array = np.asarray(bound_list, dtype=np.float64).reshape(-1, 4)
+    # One reduction for both minima and one for both maxima, NaN-bounds of empty geometries are ignored
+    lower, upper = np.fmin.reduce(bounds_array[:, :2]), np.fmax.reduce(bounds_array[:, 2:])
+    return lower[0], lower[1], upper[0], upper[1]
 
 
 def transform_bounds(bounds, origin, rotation=0, scale=1.):
@@ -414,3 +538,69 @@ def transform_bounds(bounds, origin, rotation=0, scale=1.):
         return bounds
     else:
         return (scale * np.array(bounds).reshape(2, 2) + origin).flatten()
+
+
+if njit is not None:
+    @njit(cache=True)
+    def _transform_bounds_kernel(bounds, origins, cos, sin, out):
+        for k in range(bounds.shape[0]):
+            for corner in range(4):
+                x, y = bounds[k, 2 * (corner // 2)], bounds[k, 1 + 2 * (corner % 2)]
+                # Same order of operations as the NumPy implementation, so the results are identical
+                transformed_x = cos[k] * x + -sin[k] * y + origins[k, 0]
+                transformed_y = sin[k] * x + cos[k] * y + origins[k, 1]
+                if corner == 0:
+                    out[k, 0] = out[k, 2] = transformed_x
+                    out[k, 1] = out[k, 3] = transformed_y
+                else:
+                    out[k, 0], out[k, 2] = min(out[k, 0], transformed_x), max(out[k, 2], transformed_x)
+                    out[k, 1], out[k, 3] = min(out[k, 1], transformed_y), max(out[k, 3], transformed_y)
+
+    @njit(cache=True)
+    def _rotate_points_kernel(points, cos, sin, offset_x, offset_y, out):
+        for i in range(points.shape[0]):
+            x, y = points[i, 0], points[i, 1]
+            out[i, 0] = x * cos + y * -sin + offset_x
+            out[i, 1] = x * sin + y * cos + offset_y
+
+
+def transform_bounds_array(bounds, origins, rotations):
+    """
+    Vectorized version of transform_bounds, transforms K bounds by the corresponding origins and rotations.
+    If numba is installed, large arrays are transformed by a compiled loop.
+
+    :param bounds: (K, 4)-array of bounds in the form (xmin, ymin, xmax, ymax)
+    :param origins: (K, 2)-array of offsets
+    :param rotations: K rotation angles
+    :return: (K, 4)-array of the transformed bounds
+    """
+    bounds = np.asarray(bounds, dtype=np.float64).reshape(-1, 4)
+    origins = np.asarray(origins, dtype=np.float64).reshape(-1, 2)
+    c, s = np.cos(np.asarray(rotations, dtype=np.float64)), np.sin(np.asarray(rotations, dtype=np.float64))
+    if njit is not None and bounds.shape[0] >= 64:  # For few bounds, loading the compiled loop isn't worth it
+        out = np.empty((bounds.shape[0], 4))
+        _transform_bounds_kernel(np.ascontiguousarray(bounds), np.ascontiguousarray(origins), c, s, out)
+        return out
+    corners = bounds[:, [[0, 1], [0, 3], [2, 1], [2, 3]]]
+    rot_matrices = np.stack((np.stack((c, -s), axis=-1), np.stack((s, c), axis=-1)), axis=-2)
+    corners = np.einsum('kij,kpj->kpi', rot_matrices, corners) + origins[:, np.newaxis, :]
+    return np.concatenate((corners.min(axis=1), corners.max(axis=1)), axis=1)
+
+
+def rotate_points(points, angle, offset=(0, 0)):
+    """
+    Rotates an (N, 2)-array of points by `angle` around (0, 0) and moves them by `offset`.
+    If numba is installed, large arrays are transformed by a compiled loop.
+
+    :param points: (N, 2)-array of points
+    :param angle: rotation angle
+    :param offset: offset added after the rotation
+    :return: (N, 2)-array of the transformed points
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    c, s = math.cos(angle), math.sin(angle)
+    if njit is not None and points.shape[0] >= 64:  # For few points, loading the compiled loop isn't worth it
+        out = np.empty_like(points)
+        _rotate_points_kernel(np.ascontiguousarray(points), c, s, float(offset[0]), float(offset[1]), out)
+        return out
+    return points.dot(np.array([[c, s], [-s, c]])) + offset
@@ -60,6 +60,8 @@ class Alignment:
                                                    self._ALIGNMENT['y'].keys()
 
         self._alignment = '-'.join(options)
+        # Only the options are stored, as the functions themselves can't be pickled
+        self._alignment_options = tuple(options)
 
     @property
     def alignment_functions(self):
@@ -69,8 +71,8 @@ class Alignment:
         :return: Tuple of functions.
         :rtype: tuple
         """
-        options = self.alignment.split('-')
-        return self._ALIGNMENT['x'][options[0]], self._ALIGNMENT['y'][options[1]]
+        x_option, y_option = self._alignment_options
+        return self._ALIGNMENT['x'][x_option], self._ALIGNMENT['y'][y_option]
 
     def calculate_offset(self, bbox):
         """
@@ -81,6 +83,5 @@ class Alignment:
         :rtype: np.array
         """
         bbox = np.asarray(bbox)
-        alignment_fun = self.alignment_functions
-        offset = np.array([-alignment_fun[i](bbox) for i in [0, 1]])
-        return offset
+        x_fun, y_fun = self.alignment_functions
+        return -np.array([x_fun(bbox), y_fun(bbox)])
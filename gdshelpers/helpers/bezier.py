@@ -4,15 +4,30 @@ import numpy as np
 class CubicBezierCurve:
     def __init__(self, p0, p1, p2, p3):
         self._p0, self._p1, self._p2, self._p3 = [np.asarray(p) for p in (p0, p1, p2, p3)]
+        # Coefficients of the polynomial a*t**3 + b*t**2 + c*t + d and of its derivative, shaped for broadcasting
+        p0, p1, p2, p3 = [np.asarray(p, dtype=np.float64)[..., None] for p in (p0, p1, p2, p3)]
+        self._coefficients = (-p0 + 3 * p1 - 3 * p2 + p3, 3 * p0 - 6 * p1 + 3 * p2, -3 * p0 + 3 * p1, p0)
+        self._coefficients_d1 = (3 * self._coefficients[0], 2 * self._coefficients[1], self._coefficients[2])
+
+    @staticmethod
+    def _evaluate_polynomial(coefficients, t):
+        """
+        Evaluates the polynomial in Horner's form, all steps are done in-place on a single output array.
+        """
+        t = np.asarray(t)
+        result = np.empty(np.broadcast(coefficients[0], t).shape, dtype=np.result_type(coefficients[0], t))
+        np.multiply(coefficients[0], t, out=result)
+        for coefficient in coefficients[1:-1]:
+            np.add(result, coefficient, out=result)
+            np.multiply(result, t, out=result)
+        np.add(result, coefficients[-1], out=result)
+        return result
 
     def evaluate(self, t):
-        return (1 - t) ** 3 * self._p0[..., None] + 3 * (1 - t) ** 2 * t * self._p1[..., None] \
-               + 3 * (1 - t) * t ** 2 * self._p2[..., None] + t ** 3 * self._p3[..., None]
+        return self._evaluate_polynomial(self._coefficients, t)
 
     def evaluate_d1(self, t):
-        return 3 * (1 - t) ** 2 * (self._p1[..., None] - self._p0[..., None]) \
-               + 6 * (1 - t) * t * (self._p2[..., None] - self._p1[..., None]) \
-               + 3 * t ** 2 * (self._p3[..., None] - self._p2[..., None])
+        return self._evaluate_polynomial(self._coefficients_d1, t)
 
     def split(self, t):
         """
@@ -21,18 +36,19 @@ class CubicBezierCurve:
         :param t:
         :return:
         """
-        p1, p2, p3, p4 = self._p0, self._p1, self._p2, self._p3
-
-        p12 = (p2 - p1) * t + p1
-        p23 = (p3 - p2) * t + p2
-        p34 = (p4 - p3) * t + p3
-
-        p123 = (p23 - p12) * t + p12
-        p234 = (p34 - p23) * t + p23
-
-        p1234 = (p234 - p123) * t + p123
-
-        return CubicBezierCurve(p1, p12, p123, p1234), CubicBezierCurve(p1234, p234, p34, p4)
+        s = 1 - t
+        # de Casteljau's algorithm in matrix form, the rows give the control points of both halves
+        left = np.array([[1, 0, 0, 0],
+                         [s, t, 0, 0],
+                         [s ** 2, 2 * s * t, t ** 2, 0],
+                         [s ** 3, 3 * s ** 2 * t, 3 * s * t ** 2, t ** 3]])
+        right = np.array([[s ** 3, 3 * s ** 2 * t, 3 * s * t ** 2, t ** 3],
+                          [0, s ** 2, 2 * s * t, t ** 2],
+                          [0, 0, s, t],
+                          [0, 0, 0, 1]])
+        control_points = np.stack((self._p0, self._p1, self._p2, self._p3))
+
+        return CubicBezierCurve(*left @ control_points), CubicBezierCurve(*right @ control_points)
 
 
 if __name__ == '__main__':
@@ -24,10 +24,10 @@ class SquareMarker:
         return cls(origin, size)
 
     def get_shapely_object(self):
-        x, y = self.origin
         size = self.size
-        box = shapely.geometry.box(0, 0, size, size)
-        return shapely.affinity.translate(box, x - size / 2, y - size / 2)
+        x, y = self.origin - size / 2
+        # Same coordinates as translating a box at the origin, without building it first
+        return shapely.geometry.box(x, y, x + size, y + size)
 
 
 class CrossMarker:
@@ -1,3 +1,5 @@
+from functools import lru_cache
+
 import numpy as np
 import shapely.geometry
 import shapely.ops
@@ -8,6 +10,54 @@ from gdshelpers.helpers import normalize_phase
 from gdshelpers.helpers.alignment import Alignment
 
 
+@lru_cache(maxsize=None)
+def _glyph_lines(font, char):
+    # The strokes of a character as arrays of points for a text of height 1
+    return [np.array(line).T for line in _fonts.FONTS[font][char]['lines']]
+
+
+@lru_cache(maxsize=1024)
+def _render_text(text, font, height, line_spacing):
+    """
+    Renders the text without alignment, cached as the same labels are often placed many times.
+
+    :return: The merged polygon of all characters, the width of the text and the y-position of the last line
+    """
+    polygons = list()
+
+    special_handling_chars = '\n'
+    font_dict = _fonts.FONTS[font]
+
+    # Check the text
+    for char in text:
+        if char in special_handling_chars:
+            continue
+        assert char in font_dict, 'Character "%s" is not supported by font "%s"' % (char, font)
+
+    max_x = 0
+    cursor_x, cursor_y = 0, 0
+    for i, char in enumerate(text):
+        if char == '\n':
+            cursor_x, cursor_y = 0, cursor_y - line_spacing
+            continue
+
+        char_font = font_dict[char]
+        cursor_x += char_font['width'] / 2 * height
+
+        for line in _glyph_lines(font, char):
+            points = line * height + (cursor_x, cursor_y)
+            polygons.append(shapely.geometry.Polygon(points))
+
+        # Add kerning
+        if i < len(text) - 1 and text[i + 1] not in special_handling_chars:
+            kerning = char_font['kerning'][text[i + 1]]
+            cursor_x += (char_font['width'] / 2 + kerning) * height
+
+        max_x = max(max_x, cursor_x + char_font['width'] / 2 * height)
+
+    return shapely.ops.unary_union(polygons), max_x, cursor_y
+
+
 class Text:
     def __init__(self, origin, height, text='', alignment='left-bottom', angle=0., font='stencil', line_spacing=1.5,
                  true_bbox_alignment=False):
@@ -83,41 +133,7 @@ class Text:
         if self._shapely_object:
             return self._shapely_object
 
-        # Let's do the actual rendering
-
-        polygons = list()
-
-        special_handling_chars = '\n'
-        font = _fonts.FONTS[self.font]
-
-        # Check the text
-        for char in self.text:
-            if char in special_handling_chars:
-                continue
-            assert char in font, 'Character "%s" is not supported by font "%s"' % (char, self.font)
-
-        max_x = 0
-        cursor_x, cursor_y = 0, 0
-        for i, char in enumerate(self.text):
-            if char == '\n':
-                cursor_x, cursor_y = 0, cursor_y - self.line_spacing
-                continue
-
-            char_font = font[char]
-            cursor_x += char_font['width'] / 2 * self.height
-
-            for line in char_font['lines']:
-                points = np.array(line).T * self.height + (cursor_x, cursor_y)
-                polygons.append(shapely.geometry.Polygon(points))
-
-            # Add kerning
-            if i < len(self.text) - 1 and self.text[i + 1] not in special_handling_chars:
-                kerning = char_font['kerning'][self.text[i + 1]]
-                cursor_x += (char_font['width'] / 2 + kerning) * self.height
-
-            max_x = max(max_x, cursor_x + char_font['width'] / 2 * self.height)
-
-        merged_polygon = shapely.ops.unary_union(polygons)
+        merged_polygon, max_x, cursor_y = _render_text(self.text, self.font, self.height, self.line_spacing)
 
         # Handle the alignment, translation and rotation
         if not self.true_bbox_alignment:
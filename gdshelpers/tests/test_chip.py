@@ -68,6 +68,197 @@ class DeviceTestCase(unittest.TestCase):
 
         self.assertEqual(cell.bounds, (100, 0, 500, 200))
 
+    def test_bounds_cache(self):
+        cell = Cell('test_cell')
+        subcell = Cell('subcell')
+        subsubcell = Cell('subsubcell')
+        subsubcell.add_to_layer(1, box(0, 0, 10, 10))
+        subcell.add_cell(subsubcell, origin=(10, 0))
+        cell.add_cell(subcell, origin=(0, 10))
+        self.assertEqual(cell.bounds, (10, 10, 20, 20))
+
+        # changes of sub-sub-cells have to invalidate the cached bounds of the sub-cells
+        version = cell.get_version()
+        subsubcell.add_to_layer(2, box(0, 0, 20, 20))
+        self.assertNotEqual(cell.get_version(), version)
+        self.assertEqual(cell.bounds, (10, 10, 30, 30))
+        self.assertEqual(cell.get_bounds(layers=[1]), (10, 10, 20, 20))
+
+        # as well as changes of the origin
+        cell.cells[0]['origin'] = (0, 0)
+        self.assertEqual(cell.bounds, (10, 0, 30, 20))
+
+        # geometries added to a layer after its bounds have been calculated
+        for i in range(10):
+            subsubcell.add_to_layer(1, box(0, 0, 30 + i, 5))
+            self.assertEqual(subsubcell.get_bounds(layers=[1]), (0, 0, 30 + i, 10))
+        self.assertEqual(cell.bounds, (10, 0, 49, 20))
+
+        # the cached envelope is extended by geometries added to new and existing layers
+        subsubcell.add_to_layer(3, box(-5, 1, 1, 2), box(0, -1, 1, 1))
+        subsubcell.add_to_layer(1)
+        self.assertEqual(subsubcell.bounds, (-5, -1, 39, 20))
+        subsubcell.layer_dict[3].append(box(0, -3, 1, 1))
+        subsubcell.add_to_layer(3, box(0, 0, 1, 1))
+        self.assertEqual(subsubcell.bounds, (-5, -3, 39, 20))
+
+        # the envelopes of the layers are updated as well when a layer is changed directly
+        del subsubcell.layer_dict[3][:]
+        self.assertEqual(subsubcell.get_bounds(layers=[3]), None)
+        self.assertEqual(subsubcell.get_bounds(layers=[1, 3]), (0, 0, 39, 10))
+
+    def test_bounds_modified_part(self):
+        waveguide = Waveguide([0, 0], 0, 1)
+        waveguide.add_straight_segment(10)
+        cell = Cell('part_cell')
+        cell.add_to_layer(1, waveguide)
+        cell.add_to_layer(2, box(0, 0, 1, 1))
+        top_cell = Cell('top_cell')
+        top_cell.add_cell(cell, origin=(0, 10))
+        self.assertEqual(cell.get_bounds(layers=[1]), (0, -0.5, 10, 0.5))
+        self.assertEqual(cell.bounds, (0, -0.5, 10, 1))
+        self.assertEqual(top_cell.bounds, (0, 9.5, 10, 11))
+
+        # parts might be modified after they have been added, so the bounds of their layers aren't cached
+        waveguide.add_straight_segment(90)
+        self.assertEqual(cell.get_bounds(layers=[1]), (0, -0.5, 100, 0.5))
+        self.assertEqual(cell.bounds, (0, -0.5, 100, 1))
+        self.assertEqual(top_cell.get_bounds(layers=[1]), (0, 9.5, 100, 10.5))
+        self.assertEqual(top_cell.bounds, (0, 9.5, 100, 11))
+        self.assertEqual(top_cell.get_bounds(layers=[2]), (0, 10, 1, 11))
+
+    def test_reduced_layer_cache(self):
+        cell = Cell('test_cell')
+        subcell = Cell('subcell')
+        subcell.add_to_layer(1, box(0, 0, 10, 10))
+        cell.add_cell(subcell, origin=(10, 0))
+        cell.add_to_layer(1, box(0, 0, 10, 10))
+
+        reduced_layer = cell.get_reduced_layer(1)
+        self.assertAlmostEqual(reduced_layer.area, 200)
+        self.assertIs(cell.get_reduced_layer(1), reduced_layer)
+
+        subcell.add_to_layer(1, box(0, 10, 10, 20))
+        self.assertAlmostEqual(cell.get_reduced_layer(1).area, 300)
+
+        # transformations of nested, rotated and arrayed cells are combined
+        top_cell = Cell('top_cell')
+        top_cell.add_cell(cell, origin=(100, 0), angle=np.pi / 2, columns=2, rows=3, spacing=(50, 50))
+        self.assertAlmostEqual(top_cell.get_reduced_layer(1).area, 6 * 300)
+        self.assertEqual(top_cell.get_reduced_layer(1).bounds, (80, 0, 150, 120))
+
+        # parts might be modified after they have been added, so their layers aren't cached
+        waveguide = Waveguide([0, 0], 0, 1)
+        waveguide.add_straight_segment(10)
+        subcell.add_to_layer(2, waveguide)
+        self.assertAlmostEqual(cell.get_reduced_layer(2).area, 10)
+        waveguide.add_straight_segment(10)
+        self.assertAlmostEqual(cell.get_reduced_layer(2).area, 20)
+
+    def test_transformations(self):
+        from gdshelpers.geometry.shapely_adapter import transform_bounds, transform_bounds_array, rotate_points, \
+            bounds_union
+
+        rng = np.random.RandomState(0)
+        bounds = np.sort(rng.uniform(-10, 10, (100, 2, 2)), axis=1).transpose(0, 2, 1).reshape(-1, 4)
+        origins, angles = rng.uniform(-100, 100, (100, 2)), rng.uniform(-7, 7, 100)
+
+        # large arrays might be transformed by a compiled loop, small ones by NumPy, the results have to be identical
+        transformed = transform_bounds_array(bounds, origins, angles)
+        np.testing.assert_array_equal(transformed, np.concatenate(
+            [transform_bounds_array(bounds[i:i + 10], origins[i:i + 10], angles[i:i + 10]) for i in range(0, 100, 10)]))
+        np.testing.assert_almost_equal(transformed, [transform_bounds(*args) for args in zip(bounds, origins, angles)])
+
+        rotated = rotate_points(origins, 0.3, (1, 2))
+        np.testing.assert_array_equal(rotated, np.concatenate(
+            [rotate_points(origins[i:i + 10], 0.3, (1, 2)) for i in range(0, 100, 10)]))
+        np.testing.assert_almost_equal(rotate_points([(1, 0)], np.pi / 2, (1, 2)), [(1, 3)])
+
+        # bounds of empty geometries are ignored
+        self.assertEqual(bounds_union([(0, 1, 2, 3), (np.nan,) * 4, (-1, 2, 1, 4)]), (-1, 1, 2, 4))
+
+    def test_fracture(self):
+        from shapely.geometry import LineString, Point, Polygon
+        from gdshelpers.geometry.shapely_adapter import fracture, _cut_into_strips, _number_of_points
+
+        # a spiral would be cut into many more pieces by strips than by halving it
+        t = np.linspace(0, 8 * np.pi, 4000)
+        spiral = LineString(np.stack((t * np.cos(t), t * np.sin(t)), axis=1)).buffer(0.5)
+        self.assertIsNone(_cut_into_strips(spiral, 21))
+        pieces = fracture(spiral, 199, 199)
+        self.assertTrue(all(_number_of_points(piece) <= 199 for piece in pieces))
+        self.assertAlmostEqual(sum(piece.area for piece in pieces), spiral.area, places=3)
+        self.assertLess(len(pieces), 400)
+
+        # the prongs of a U split one strip, even though the strip at their tips only contains lines
+        u_shape = Polygon([(0, 0), (3, 0), (3, 10), (2, 10), (2, 1), (1, 1), (1, 10), (0, 10)])
+        self.assertIsNone(_cut_into_strips(u_shape, 3))
+
+        # a convex polygon is cut into strips at once
+        circle = Point(0, 0).buffer(10, resolution=1000)
+        self.assertEqual(len(_cut_into_strips(circle, 21)), 21)
+        pieces = fracture(circle, 199, 199)
+        self.assertTrue(all(_number_of_points(piece) <= 199 for piece in pieces))
+        self.assertAlmostEqual(sum(piece.area for piece in pieces), circle.area, places=3)
+
+    def test_export_mesh(self):
+        import trimesh
+
+        cell = Cell('test_cell')
+        cell.add_to_layer(1, box(0, 0, 10, 10))
+        cell.add_to_layer(2, box(20, 0, 30, 10), box(40, 0, 50, 10))
+
+        cell.export_mesh('serial.stl', {1: (0, 1), 2: (0, 2)})
+        cell.export_mesh('parallel.stl', {1: (0, 1), 2: (0, 2)}, parallel=True)
+        self.assertAlmostEqual(trimesh.load('serial.stl').volume, 500)
+        self.assertAlmostEqual(trimesh.load('parallel.stl').volume, 500)
+
+    def test_patches(self):
+        import numpy.testing as np_testing
+
+        cell1 = Cell('cell1')
+        cell1.add_to_layer(1, box(0, 0, 1, 1))
+        cell2 = Cell('cell2')
+        cell2.add_cell(cell1, (5, 0), angle=0.3)
+        cell3 = Cell('cell3')
+        cell3.add_cell(cell2, (3, 1), angle=0.5)
+        cell4 = Cell('cell4')
+        cell4.add_cell(cell3, (7, -2), angle=0.7)
+
+        patches = cell4.get_patches()
+        self.assertEqual(len(patches), 1)
+        vertices = patches[0].get_path().vertices
+        np_testing.assert_almost_equal(np.concatenate((vertices.min(axis=0), vertices.max(axis=0))),
+                                       cell4.get_reduced_layer(1).bounds)
+
+        # all polygons of a layer end up in one path, exteriors counter-clockwise and holes clockwise
+        from shapely.geometry.polygon import orient
+        cell5 = Cell('cell5')
+        cell5.add_to_layer(1, orient(box(0, 0, 2, 2).difference(box(0.5, 0.5, 1.5, 1.5)), -1), box(3, 0, 4, 1))
+        cell5.add_to_layer(2, LineString([(0, 0), (1, 1)]))
+        patches = cell5.get_patches()
+        self.assertEqual(len(patches), 1)
+        path = patches[0].get_path()
+        self.assertEqual(len(path.to_polygons()), 3)
+        signed_areas = [np.sum(ring[:-1, 0] * ring[1:, 1] - ring[1:, 0] * ring[:-1, 1]) / 2
+                        for ring in path.to_polygons(closed_only=False)]
+        self.assertEqual(sorted(signed_areas), [-1, 1, 4])
+
+    def test_save_image(self):
+        import matplotlib.image
+
+        cell = Cell('image_cell')
+        cell.add_to_layer(1, box(0, 0, 10, 10))
+        subcell = Cell('image_subcell')
+        subcell.add_to_layer(2, box(0, 0, 10, 10))
+        cell.add_cell(subcell, (20, 0), angle=np.pi / 4)
+
+        cell.save_image('image_cell.png', antialiased=False)
+        image = matplotlib.image.imread('image_cell.png')
+        # red (layer 1) and green (layer 2) patches on a transparent background
+        opaque_colors = image[image[..., 3] == 1][:, :3].round(1)
+        self.assertEqual(set(map(tuple, opaque_colors)), {(1, 0, 0), (0, 0.5, 0)})
+
     def test_empty_cell(self):
         # An empty cell should have 'None' as bounding box
         cell = Cell('test_cell')
@@ -180,3 +371,76 @@ class DeviceTestCase(unittest.TestCase):
         top.add_cell(child2, [0, 0])
         with self.assertRaises(ValueError):
             top.add_cell(child2, [100, 0])
+
+    def test_dlw_data(self):
+        leaf = Cell('leaf')
+        leaf.add_dlw_marker('m', 1, (10, 0))
+        middle = Cell('middle')
+        middle.add_cell(leaf, (0, 5), angle=np.pi / 2)
+        top = Cell('top')
+        top.add_cell(middle, (100, 0), angle=np.pi / 2)
+
+        for _ in range(2):
+            marker = top.get_dlw_data()['marker']['middle.leaf.m']
+            np.testing.assert_almost_equal(marker['origin'], (85, 0))
+            self.assertAlmostEqual(marker['angle'], np.pi)
+        self.assertEqual(top.dlw_data, {})
+        self.assertEqual(list(middle.dlw_data), [])
+
+        # the cached DLW data is updated when DLW data is added to a sub-cell and can't be modified by callers
+        top.get_dlw_data()['marker'].clear()
+        top.get_dlw_data()['marker']['middle.leaf.m']['origin'][0] = 0
+        np.testing.assert_almost_equal(top.get_dlw_data()['marker']['middle.leaf.m']['origin'], (85, 0))
+        leaf.get_dlw_data()['marker']['m']['origin'] = [0, 0]
+        np.testing.assert_almost_equal(leaf.dlw_data['marker']['m']['origin'], (10, 0))
+        leaf.add_dlw_data('marker', 'n', {'origin': [0, 0], 'angle': 0})
+        self.assertEqual(sorted(top.get_dlw_data()['marker']), ['middle.leaf.m', 'middle.leaf.n'])
+
+        desc = top.get_desc()
+        self.assertEqual(desc['cells']['middle']['cells']['leaf']['offset'], (0, 5))
+        self.assertIn('m', desc['cells']['middle']['cells']['leaf']['dlw']['marker'])
+
+    def test_oasis_repeated_geometry(self):
+        import fatamorgana
+
+        wg = Waveguide([0, 0], 0, 1)
+        wg.add_straight_segment(10)
+        top = Cell('top_oasis')
+        for i in range(2):
+            child = Cell('child_oasis_{}'.format(i))
+            child.add_to_layer(1, wg)
+            child.add_to_layer((2, 3), wg)
+            top.add_cell(child, (0, 10 * i))
+        top.add_cell(child, (0, 30))
+        top.add_to_layer(1, wg, wg)
+
+        for parallel in (False, True):
+            top.save('repeated.oas', parallel=parallel)
+            with open('repeated.oas', 'rb') as f:
+                layout = fatamorgana.OasisLayout.read(f)
+            self.assertEqual(sorted(len(cell.geometry) for cell in layout.cells), [2, 2, 2])
+            for cell in [top] + [sub_cell['cell'] for sub_cell in top.cells]:
+                cell.cell_oasis = None
+
+        # cells referenced several times are only returned once
+        self.assertEqual([cell.name.string for cell in top.get_oasis_cells()],
+                         ['top_oasis', 'child_oasis_0', 'child_oasis_1'])
+
+    def test_oasis_array_numpy_spacing(self):
+        import fatamorgana
+
+        wg = Waveguide([0, 0], 0, 1)
+        wg.add_straight_segment(10)
+        child = Cell('child_oasis_array')
+        child.add_to_layer(1, wg)
+        top = Cell('top_oasis_array')
+        top.add_cell(child, columns=3, rows=2, spacing=np.array([20., 30.]))
+
+        top.save('array.oas')
+        with open('array.oas', 'rb') as f:
+            layout = fatamorgana.OasisLayout.read(f)
+        top_cell = next(cell for cell in layout.cells if cell.name.string == 'top_oasis_array')
+        repetition = top_cell.placements[0].repetition
+        self.assertEqual((repetition.a_count, repetition.b_count), (3, 2))
+        self.assertEqual(list(repetition.a_vector), [20000, 0])
+        self.assertEqual(list(repetition.b_vector), [0, 30000])
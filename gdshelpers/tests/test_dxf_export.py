@@ -0,0 +1,52 @@
+import unittest
+
+import numpy as np
+from shapely.geometry import box
+
+from gdshelpers.parts.waveguide import Waveguide
+from gdshelpers.geometry.chip import Cell
+
+try:
+    import ezdxf
+    from gdshelpers.export.dxf_export import write_cell_to_dxf_file
+except ImportError:  # ezdxf is an optional dependency
+    ezdxf = None
+
+
+@unittest.skipUnless(ezdxf, 'ezdxf is not installed')
+class DxfTestCase(unittest.TestCase):
+    def test_parallel_export(self):
+        waveguide = Waveguide([0, 0], 0, 1)
+        for i_bend in range(9):
+            waveguide.add_bend(angle=np.pi, radius=60 + i_bend * 40)
+
+        sub_cell = Cell('sub_cell')
+        sub_cell.add_to_layer(2, waveguide)
+
+        cell = Cell('main')
+        cell.add_to_layer(1, waveguide)
+        cell.add_cell(sub_cell, (10, 10))
+        cell.add_cell(sub_cell, (100, 10), angle=np.pi / 2)
+
+        with open('serial.dxf', 'w') as f:
+            write_cell_to_dxf_file(f, cell, parallel=False)
+        with open('parallel.dxf', 'w') as f:
+            write_cell_to_dxf_file(f, cell, parallel=True)
+
+        serial, parallel = ezdxf.readfile('serial.dxf'), ezdxf.readfile('parallel.dxf')
+        for name in ('main', 'sub_cell'):
+            self.assertEqual(len(serial.blocks.get(name)), len(parallel.blocks.get(name)))
+        self.assertEqual(len(serial.blocks.get('main').query('INSERT')), 2)
+        self.assertIn('1-1', serial.layers)
+        self.assertIn('2-2', serial.layers)
+
+    def test_binary_export(self):
+        cell = Cell('main')
+        cell.add_to_layer(1, box(0, 0, 10, 10))
+
+        with open('binary.dxf', 'wb') as f:
+            write_cell_to_dxf_file(f, cell)
+
+        with open('binary.dxf', 'rb') as f:
+            self.assertTrue(f.read().startswith(b'AutoCAD Binary DXF'))
+        self.assertEqual(len(ezdxf.readfile('binary.dxf').blocks.get('main').query('LWPOLYLINE')), 1)
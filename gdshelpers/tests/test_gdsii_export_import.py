@@ -1,12 +1,17 @@
+import datetime
 import filecmp
 import unittest
+from io import BytesIO
 
 import numpy as np
 from shapely.affinity import translate, rotate
+from shapely.geometry import box
 
 from gdshelpers.parts.waveguide import Waveguide
 from gdshelpers.geometry.chip import Cell
 from gdshelpers.parts.pattern_import import GDSIIImport
+from gdshelpers.export.gdsii_export import write_cell_to_gdsii_file, _real_to_8byte, _real_to_8byte_array, \
+    _real_to_8byte_array_numpy, _write_buffers
 
 
 class GdsTestCase(unittest.TestCase):
@@ -61,3 +66,75 @@ class GdsTestCase(unittest.TestCase):
         cells[0].save('parallel.gds', parallel=True)
 
         self.assertTrue(filecmp.cmp('serial.gds', 'parallel.gds'))
+
+    def test_unique_cell_names(self):
+        cell = Cell('main')
+        sub_cell = Cell('sub_cell')
+        sub_cell.add_to_layer(1, box(0, 0, 1, 1))
+        cell.add_cell(sub_cell, (0, 0))
+        cell.add_cell(sub_cell, (10, 0))
+
+        with BytesIO() as b:
+            write_cell_to_gdsii_file(b, cell)
+
+        cell.add_cell(Cell('sub_cell'), (20, 0))
+        with BytesIO() as b:
+            self.assertRaises(AssertionError, write_cell_to_gdsii_file, b, cell)
+
+    def test_real_to_8byte(self):
+        values = [0., 1., -2.5, 1 / 16, 90., 359.9999, 1e-9, 123456.789]
+        self.assertEqual(_real_to_8byte_array(values), b''.join(_real_to_8byte(value) for value in values))
+        self.assertEqual(_real_to_8byte_array_numpy(np.array(values)).astype('>u8').tobytes(),
+                         _real_to_8byte_array(values))
+        self.assertEqual(_real_to_8byte(-2.5), bytes.fromhex('c128000000000000'))
+
+    def test_write_buffers(self):
+        for buffering in (-1, 0):
+            with open('buffers.bin', 'wb', buffering=buffering) as f:
+                f.write(b'a')
+                _write_buffers(f, [b'bc', b'de'])
+                # buffered files continue at the position after the buffers
+                self.assertEqual(f.tell(), 5)
+                f.write(b'f')
+            with open('buffers.bin', 'rb') as f:
+                self.assertEqual(f.read(), b'abcdef')
+
+    def test_process_pool_export(self):
+        waveguide = Waveguide([0, 0], 0, 1)
+        waveguide.add_bend(angle=np.pi, radius=60)
+
+        cell = Cell('main')
+        sub_cell = Cell('sub_cell')
+        sub_cell.add_to_layer(1, waveguide)
+        cell.add_cell(sub_cell, (10, 10), angle=np.pi / 2)
+
+        timestamp = datetime.datetime(2020, 1, 1)
+        with BytesIO() as serial, BytesIO() as parallel:
+            write_cell_to_gdsii_file(serial, cell, timestamp=timestamp)
+            write_cell_to_gdsii_file(parallel, cell, timestamp=timestamp, parallel=True)
+            self.assertEqual(serial.getvalue(), parallel.getvalue())
+
+        with BytesIO() as serial, BytesIO() as parallel:
+            write_cell_to_gdsii_file(serial, cell, timestamp=timestamp)
+            write_cell_to_gdsii_file(parallel, cell, timestamp=timestamp, parallel=True, use_processes=False)
+            self.assertEqual(serial.getvalue(), parallel.getvalue())
+
+    def test_intra_cell_parallel_export(self):
+        waveguide = Waveguide([0, 0], 0, 1)
+        waveguide.add_bend(angle=np.pi, radius=60)
+
+        cell = Cell('main')
+        cell.add_to_layer(1, waveguide)
+        cell.add_to_layer(2, box(0, 0, 10, 10))
+        cell.add_to_layer((3, 1), waveguide)
+
+        timestamp = datetime.datetime(2020, 1, 1)
+        with BytesIO() as serial, BytesIO() as parallel:
+            write_cell_to_gdsii_file(serial, cell, timestamp=timestamp)
+            write_cell_to_gdsii_file(parallel, cell, timestamp=timestamp, intra_cell_parallel=True, use_processes=False)
+            self.assertEqual(serial.getvalue(), parallel.getvalue())
+
+        with BytesIO() as serial, BytesIO() as parallel:
+            write_cell_to_gdsii_file(serial, cell, timestamp=timestamp)
+            write_cell_to_gdsii_file(parallel, cell, timestamp=timestamp, intra_cell_parallel=True)
+            self.assertEqual(serial.getvalue(), parallel.getvalue())
@@ -26,3 +26,16 @@ class HelpersTestCase(unittest.TestCase):
         test_intersection = find_line_intersection(np.array((2, 0)), np.pi / 2, np.array((0, 1)), 0)
         npt.assert_almost_equal(test_intersection[0], (2, 1))
         npt.assert_almost_equal(test_intersection[1], (1, 2))
+
+    def test_pickle_text(self):
+        import pickle
+        from gdshelpers.parts.text import Text
+        from gdshelpers.helpers.alignment import Alignment
+
+        text = Text((0, 0), 10, 'ABC', alignment='center-top')
+        unpickled = pickle.loads(pickle.dumps(text))
+        self.assertAlmostEqual(unpickled.get_shapely_object().area, text.get_shapely_object().area)
+        self.assertEqual(unpickled.alignment, 'center-top')
+
+        alignment = pickle.loads(pickle.dumps(Alignment('center-top')))
+        npt.assert_almost_equal(alignment.calculate_offset(((0, 0), (2, 4))), (-1, -4))
@@ -31,9 +31,10 @@ setup(
         'oasis_export': ['fatamorgana'],
         'dxf_export': ['ezdxf'],
         'image_import': ['imageio'],
-        'image_export': ['descartes'],
+        'image_export': [],
         'mesh_export': ['trimesh'],
-        'fdtd_simulation': ['meep']
+        'fdtd_simulation': ['meep'],
+        'jit': ['numba']
     },
     test_suite='gdshelpers.tests',
     classifiers=[